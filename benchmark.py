@@ -0,0 +1,190 @@
+import argparse, json, os, platform, random, resource, sys, tempfile, time
+from itertools import accumulate
+from multiprocessing import get_context
+from typing import Dict, List
+from index_files import docs_addr
+from indexer import Indexer
+from search_engine import SearchEngine
+from search_service import LatencyWindow
+
+# Benchmark of indexing throughput and query latency on a synthetic Persian-like corpus (no network needed)
+# same seed and sizes give the same corpus and queries, results are written as json:
+#   python benchmark.py --docs 2000 --queries 200 --output benchmark.json
+# indexing and search run in fresh processes, so their peak RSS is measured alone
+
+PERSIAN_LETTERS = 'ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی'
+# frequent words, so stop words and lemmatizer behave like on real text
+COMMON_WORDS = ['و', 'در', 'به', 'از', 'که', 'این', 'را', 'با', 'است', 'برای', 'آن', 'یک', 'خود', 'تا', 'کرد', 'بر', 'هم', 'نیز',
+                'گفت', 'می‌شود', 'وی', 'شد', 'دارد', 'ما', 'اما', 'یا', 'شده', 'باید', 'هر', 'آنها', 'بود', 'او', 'دیگر', 'دو']
+PUNCTUATIONS = ['،', '.', '؟', '!', ':', '«', '»']
+
+# Generates {doc_id: {'title', 'content', 'url'}} with zipf distributed words
+def generate_corpus(n_docs:int, vocab_size:int=20000, doc_len:int=250, zipf_s:float=1.1, seed:int=7) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    vocab = list(COMMON_WORDS)
+    seen = set(vocab)
+    while len(vocab) < vocab_size:
+        word = ''.join(rng.choice(PERSIAN_LETTERS) for _ in range(rng.randint(2, 8)))
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    cum_weights = list(accumulate(1 / (rank ** zipf_s) for rank in range(1, vocab_size + 1)))
+    corpus = dict()
+    for doc_id in range(n_docs):
+        words = rng.choices(vocab, cum_weights=cum_weights, k=max(1, int(rng.gauss(doc_len, doc_len / 4))))
+        for i in range(len(words)):
+            if rng.random() < 0.08:
+                words[i] += rng.choice(PUNCTUATIONS)
+        corpus[str(doc_id)] = {
+            'title': ' '.join(rng.choices(vocab, cum_weights=cum_weights, k=6)),
+            'content': ' '.join(words),
+            'url': 'https://example.com/news/{}'.format(doc_id),
+        }
+    return corpus
+
+# Generates queries of 1 to 4 words taken from docs of corpus
+def generate_queries(corpus:Dict[str, dict], n_queries:int, seed:int=11) -> List[str]:
+    rng = random.Random(seed)
+    doc_ids = list(corpus.keys())
+    queries = []
+    for _ in range(n_queries):
+        words = corpus[rng.choice(doc_ids)]['content'].split()
+        length = rng.randint(1, 4)
+        start = rng.randrange(max(1, len(words) - length))
+        queries.append(' '.join(words[start:start + length]))
+    return queries
+
+# peak resident set size of this process in MB
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB on linux
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+# Runs indexer in a fresh process, so its peak RSS is measured alone
+def _run_indexer(config:dict, results):
+    indexer = Indexer(config['corpus_addr'], config['index_addr'], config['refined_db_addr'], config['remove_x_sw'],
+                      index_format=config['index_format'], workers=config['workers'], streaming=config['streaming'],
+                      champions_size=config['champions_size'])
+    start = time.perf_counter()
+    indexer.run()
+    seconds = time.perf_counter() - start
+    results.put({'seconds': seconds, 'docs_per_sec': config['docs'] / seconds if seconds > 0 else 0.0, 'peak_rss_mb': peak_rss_mb()})
+
+# Runs target(*args, results) in a fresh (spawned) process and returns what it puts in results
+def _in_fresh_process(target, *args):
+    context = get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=target, args=args + (results,))
+    process.start()
+    res = results.get()
+    process.join()
+    return res
+
+def benchmark_indexing(config:dict) -> dict:
+    res = _in_fresh_process(_run_indexer, config)
+    res['index_size_mb'] = os.path.getsize(config['index_addr']) / (1024 * 1024)
+    res['refined_db_size_mb'] = os.path.getsize(config['refined_db_addr']) / (1024 * 1024)
+    res['doc_store_size_mb'] = os.path.getsize(docs_addr(config['refined_db_addr'])) / (1024 * 1024)
+    return res
+
+# latency of each query (cache disabled) -> percentiles
+def benchmark_queries(engine:SearchEngine, queries:List[str], k:int, warmup:int) -> dict:
+    for q in queries[:warmup]:
+        engine.rank(q, k)
+    latencies = LatencyWindow(max(1, len(queries)))
+    start = time.perf_counter()
+    for q in queries:
+        query_start = time.perf_counter()
+        engine.rank(q, k)
+        latencies.add(time.perf_counter() - query_start)
+    seconds = time.perf_counter() - start
+    res = latencies.stats()
+    res['mean_ms'] = seconds / max(1, len(queries)) * 1000
+    res['qps'] = len(queries) / seconds if seconds > 0 else 0.0
+    return res
+
+# Loads search engine in a fresh process and measures its queries: tf_idf and cosine, champions lists off and on
+# load is the time of run() (index files), setup is the constructor (text processing tools, e.g. lemmatizer)
+def _run_search(config:dict, queries:List[str], k:int, warmup:int, backend:str, results):
+    start = time.perf_counter()
+    engine = SearchEngine(config['index_addr'], config['refined_db_addr'])
+    setup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    engine.run()
+    res = {'load': {'seconds': time.perf_counter() - start, 'setup_seconds': setup_seconds, 'peak_rss_mb': peak_rss_mb()}, 'queries': dict()}
+    engine.disable_cache()
+    engine.set_scoring_backend(backend)
+    for score_mode in ('tf_idf', 'cosine'):
+        engine.search_score_mode = score_mode
+        for champions in (False, True):
+            if champions:
+                engine.enable_champions_list()
+            else:
+                engine.disable_champions_list()
+            name = '{}/{}'.format(score_mode, 'champions' if champions else 'full')
+            res['queries'][name] = benchmark_queries(engine, queries, k, warmup)
+    res['peak_rss_mb'] = peak_rss_mb()
+    results.put(res)
+
+def run_benchmark(args) -> dict:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='ir_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    ext = '.bin' if args.index_format == 'binary' else '.json'
+    config = {
+        'docs': args.docs,
+        'corpus_addr': os.path.join(work_dir, 'corpus.json'),
+        'index_addr': os.path.join(work_dir, 'index' + ext),
+        'refined_db_addr': os.path.join(work_dir, 'refined_db.json'),
+        'remove_x_sw': args.remove_x_sw,
+        'index_format': args.index_format,
+        'workers': args.workers,
+        'streaming': args.streaming,
+        'champions_size': args.champions_size,
+    }
+    report = {
+        'config': {key: getattr(args, key) for key in vars(args)},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+    }
+
+    start = time.perf_counter()
+    corpus = generate_corpus(args.docs, args.vocab_size, args.doc_len, seed=args.seed)
+    with open(config['corpus_addr'], 'w', encoding='UTF-8') as file:
+        json.dump(corpus, file, ensure_ascii=False)
+    queries = generate_queries(corpus, args.queries, seed=args.seed + 1)
+    report['corpus'] = {'docs': args.docs, 'seconds': time.perf_counter() - start,
+                        'size_mb': os.path.getsize(config['corpus_addr']) / (1024 * 1024)}
+    del corpus
+
+    report['indexing'] = benchmark_indexing(config)
+
+    search = _in_fresh_process(_run_search, config, queries, args.k, args.warmup, args.backend)
+    report['load'] = search['load']
+    report['queries'] = search['queries']
+    report['search_peak_rss_mb'] = search['peak_rss_mb']
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='indexing and query latency benchmark')
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--vocab-size', type=int, default=20000)
+    parser.add_argument('--doc-len', type=int, default=250)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--remove-x-sw', type=int, default=20)
+    parser.add_argument('--index-format', default='json')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--champions-size', type=int, default=20)
+    parser.add_argument('--backend', default='python')
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--output', default='benchmark.json', help='json file of results')
+    args = parser.parse_args()
+    report = run_benchmark(args)
+    with open(args.output, 'w', encoding='UTF-8') as file:
+        json.dump(report, file, indent=2)
+    print('benchmark results are saved in {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
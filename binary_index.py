@@ -0,0 +1,271 @@
+import mmap, struct
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+from postings import CompactIndex
+
+# Binary index format
+# It is a compact alternative to index.json, which can be opened with mmap.
+#
+# layout (little-endian):
+#   header   -> magic, version, number of terms and the offsets of each section
+#   terms    -> fixed size records sorted by term bytes (used for binary search), with term statistics
+#   strings  -> utf-8 bytes of all terms
+#   docs     -> per term: varint pairs of (doc_id gap, tf)
+#   pos      -> per term: for each posting, tf varints of position gaps
+MAGIC = b'IRBI'
+VERSION = 3
+HEADER = struct.Struct('<4sHHIQQQQ')        # magic, version, reserved, n_terms, terms/strings/docs/pos offsets
+TERM_RECORD = struct.Struct('<QIIIIddQIQI') # str_off, str_len, freq, df, max_tf, idf, max_nw, docs_off, docs_len, pos_off, pos_len
+
+
+# Appends n as varint to buf
+def encode_varint(n:int, buf:bytearray):
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+# Decodes all varints of data
+def decode_varints(data:bytes) -> List[int]:
+    res = []
+    n = 0
+    shift = 0
+    for b in data:
+        if b & 0x80:
+            n |= (b & 0x7F) << shift
+            shift += 7
+        else:
+            res.append(n | (b << shift))
+            n = 0
+            shift = 0
+    return res
+
+# Checks if the file in addr is a binary index
+def is_binary_index(addr:str) -> bool:
+    try:
+        with open(addr, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+# Returns (freq, idf, max normalized weight, [(doc_id, tf, positions)] sorted by doc id) of a term
+# index is a CompactIndex or a dict in the structure of index.json
+def _term_postings(index, term:str):
+    if isinstance(index, CompactIndex):
+        entry = index.terms[term]
+        postings = [(entry.doc_ids[i], entry.tfs[i], index.posting_positions(entry, i)) for i in range(len(entry.doc_ids))]
+        return entry.freq, entry.idf, entry.max_nw, postings
+    entry = index[term]
+    postings_list = entry['postings_list']
+    postings = [(int(doc_id), postings_list[doc_id]['tf'], postings_list[doc_id]['positions']) for doc_id in sorted(postings_list.keys(), key=int)]
+    return entry['freq'], entry['idf'], entry['max_nw'], postings
+
+# Writes index (CompactIndex or dict in the same structure of index.json) in binary format
+# entries must have their statistics (idf, max_nw)
+def write_binary_index(index, addr:str):
+    terms = sorted(index.keys(), key=lambda t: t.encode('utf-8'))
+    records = bytearray()
+    strings = bytearray()
+    docs = bytearray()
+    pos = bytearray()
+    for term in terms:
+        term_bytes = term.encode('utf-8')
+        freq, idf, max_nw, postings = _term_postings(index, term)
+        str_off = len(strings)
+        strings += term_bytes
+        docs_off = len(docs)
+        pos_off = len(pos)
+        last_doc_id = 0
+        max_tf = 0
+        for doc_id, tf, positions in postings:
+            encode_varint(doc_id - last_doc_id, docs)
+            encode_varint(tf, docs)
+            last_doc_id = doc_id
+            max_tf = max(max_tf, tf)
+            last_position = 0
+            for p in positions:
+                encode_varint(p - last_position, pos)
+                last_position = p
+        records += TERM_RECORD.pack(str_off, len(term_bytes), freq, len(postings), max_tf,
+                                    idf, max_nw, docs_off, len(docs) - docs_off, pos_off, len(pos) - pos_off)
+
+    terms_off = HEADER.size
+    strings_off = terms_off + len(records)
+    docs_off = strings_off + len(strings)
+    pos_off = docs_off + len(docs)
+    with open(addr, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, len(terms), terms_off, strings_off, docs_off, pos_off))
+        file.write(records)
+        file.write(strings)
+        file.write(docs)
+        file.write(pos)
+
+
+# Read-only view over a binary index file
+# It acts like the dict loaded from index.json, but terms are decoded lazily on lookup
+class BinaryIndex:
+
+    def __init__(self, addr:str) -> None:
+        self.addr = addr
+        self.mm = None
+        self.file = open(addr, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped
+            self.file.close()
+            raise ValueError("'{}' is not a binary index".format(addr))
+        if len(self.mm) < HEADER.size:
+            self.close()
+            raise ValueError("'{}' is not a binary index".format(addr))
+        magic, version, _, self.n_terms, self.terms_off, self.strings_off, self.docs_off, self.pos_off = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("'{}' is not a binary index of version {}".format(addr, VERSION))
+        self.decoded = dict()   # term -> decoded entry
+
+    # Releases mmap and file
+    def close(self):
+        self.decoded = dict()
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    # Returns i-th term record
+    def __record(self, i:int) -> Tuple[int, ...]:
+        return TERM_RECORD.unpack_from(self.mm, self.terms_off + i * TERM_RECORD.size)
+
+    # Returns i-th term bytes
+    def __term_bytes(self, record:Tuple[int, ...]) -> bytes:
+        start = self.strings_off + record[0]
+        return self.mm[start:start + record[1]]
+
+    # Binary search on sorted term records
+    def __find(self, term:str):
+        key = term.encode('utf-8')
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self.__record(mid)
+            mid_key = self.__term_bytes(record)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return record
+        return None
+
+    # Decodes one term entry: {'freq':int, 'df':int, 'idf':float, 'max_tf':int, 'max_nw':float, 'postings_list':{'doc_id':{'tf':int, 'positions':[int]}}}
+    def __decode(self, record:Tuple[int, ...]) -> dict:
+        _, _, freq, df, max_tf, idf, max_nw, docs_off, docs_len, pos_off, pos_len = record
+        start = self.docs_off + docs_off
+        doc_tf = decode_varints(self.mm[start:start + docs_len])
+        start = self.pos_off + pos_off
+        positions = decode_varints(self.mm[start:start + pos_len])
+        postings_list = dict()
+        doc_id = 0
+        cursor = 0
+        for i in range(df):
+            doc_id += doc_tf[2 * i]
+            tf = doc_tf[2 * i + 1]
+            pl = []
+            last_position = 0
+            for gap in positions[cursor:cursor + tf]:
+                last_position += gap
+                pl.append(last_position)
+            cursor += tf
+            postings_list[str(doc_id)] = {'tf': tf, 'positions': pl}
+        return {'freq': freq, 'df': df, 'idf': idf, 'max_tf': max_tf, 'max_nw': max_nw, 'postings_list': postings_list}
+
+    # Returns (sorted doc ids, tfs, max tf, idf, max normalized weight) of a term without decoding its positions
+    def postings(self, term:str) -> Tuple[array, array, int, float, float]:
+        doc_ids = array('I')
+        tfs = array('I')
+        record = self.__find(term)
+        if record is None:
+            return doc_ids, tfs, 0, 0.0, 0.0
+        start = self.docs_off + record[7]
+        doc_tf = decode_varints(self.mm[start:start + record[8]])
+        doc_id = 0
+        for gap in doc_tf[0::2]:
+            doc_id += gap
+            doc_ids.append(doc_id)
+        tfs.extend(doc_tf[1::2])
+        return doc_ids, tfs, record[4], record[5], record[6]
+
+    # Returns {doc_id: positions} of given sorted doc ids of a term, positions of other docs are skipped without decoding
+    def positions(self, term:str, doc_ids:List[int]) -> Dict[int, List[int]]:
+        res = dict()
+        if term in self.decoded:
+            postings_list = self.decoded[term]['postings_list']
+            for doc_id in doc_ids:
+                if str(doc_id) in postings_list:
+                    res[doc_id] = postings_list[str(doc_id)]['positions']
+            return res
+        all_doc_ids, tfs, _, _, _ = self.postings(term)
+        if len(all_doc_ids) == 0:
+            return res
+        record = self.__find(term)
+        data = self.mm[self.pos_off + record[9]:self.pos_off + record[9] + record[10]]
+        cursor = 0      # byte offset of current posting in positions stream
+        i = 0           # current posting
+        for doc_id in doc_ids:
+            j = bisect_left(all_doc_ids, doc_id, i)
+            if j == len(all_doc_ids):
+                break
+            # skipping positions of postings before j: one varint ends at each byte < 0x80
+            skip = sum(tfs[i:j])
+            while skip > 0:
+                if data[cursor] < 0x80:
+                    skip -= 1
+                cursor += 1
+            i = j
+            if all_doc_ids[j] != doc_id:
+                continue
+            end = cursor
+            count = tfs[j]
+            while count > 0:
+                if data[end] < 0x80:
+                    count -= 1
+                end += 1
+            pl = []
+            last_position = 0
+            for gap in decode_varints(data[cursor:end]):
+                last_position += gap
+                pl.append(last_position)
+            res[doc_id] = pl
+            cursor = end
+            i = j + 1
+        return res
+
+    def get(self, term:str, default=None):
+        if term in self.decoded:
+            return self.decoded[term]
+        record = self.__find(term)
+        if record is None:
+            return default
+        entry = self.__decode(record)
+        self.decoded[term] = entry
+        return entry
+
+    def __getitem__(self, term:str) -> dict:
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term:str) -> bool:
+        return term in self.decoded or self.__find(term) is not None
+
+    def __len__(self) -> int:
+        return self.n_terms
+
+    def __iter__(self):
+        for i in range(self.n_terms):
+            yield self.__term_bytes(self.__record(i)).decode('utf-8')
+
+    def keys(self) -> List[str]:
+        return list(iter(self))
@@ -0,0 +1,134 @@
+import json, mmap, os, struct, sys, zlib
+from array import array
+from bisect import bisect_left
+
+# Document store
+# titles, urls and contents of docs, kept out of memory: search engine opens it with mmap and decodes
+# only the docs of displayed results (refined db keeps statistics of docs only).
+#
+# layout (little-endian):
+#   header -> magic, version, number of docs and offset of table
+#   blobs  -> per doc: zlib compressed utf-8 json of {'title', 'content', 'url'}
+#   table  -> doc ids (uint32, sorted), offsets of blobs (uint64), lengths of blobs (uint32)
+MAGIC = b'IRDS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQ')     # magic, version, reserved, n_docs, table offset
+
+
+# table arrays are written little-endian
+def _to_bytes(values:array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_bytes(typecode:str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+# Checks if the file in addr is a document store
+def is_doc_store(addr:str) -> bool:
+    try:
+        with open(addr, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+# Writes a document store doc by doc (to a temp file, it replaces addr on close)
+class DocStoreWriter:
+
+    def __init__(self, addr:str) -> None:
+        self.addr = addr
+        self.file = open(addr + '.tmp', 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self.docs = []              # (doc_id, offset, length) of blobs
+
+    def add(self, doc_id:str, doc:dict):
+        doc = {'title': doc['title'], 'content': doc['content'], 'url': doc['url']}
+        self.add_blob(doc_id, zlib.compress(json.dumps(doc, ensure_ascii=False).encode('utf-8')))
+
+    # adds a compressed doc as it is (e.g. a blob of another store)
+    def add_blob(self, doc_id:str, blob:bytes):
+        self.docs.append((int(doc_id), self.file.tell(), len(blob)))
+        self.file.write(blob)
+
+    # writes table and replaces addr with the store
+    def close(self):
+        if self.file is None:
+            return
+        # a doc added twice keeps its last version
+        docs = dict()
+        for doc_id, offset, length in self.docs:
+            docs[doc_id] = (offset, length)
+        doc_ids = sorted(docs)
+        table_off = self.file.tell()
+        self.file.write(_to_bytes(array('I', doc_ids)))
+        self.file.write(_to_bytes(array('Q', [docs[doc_id][0] for doc_id in doc_ids])))
+        self.file.write(_to_bytes(array('I', [docs[doc_id][1] for doc_id in doc_ids])))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, len(doc_ids), table_off))
+        self.file.close()
+        self.file = None
+        os.replace(self.addr + '.tmp', self.addr)
+
+    # drops the temp file (nothing is written to addr)
+    def discard(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.addr + '.tmp')
+
+
+# Read-only document store, docs are decompressed on lookup
+class DocStore:
+
+    def __init__(self, addr:str) -> None:
+        self.file = open(addr, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, n_docs, table_off = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("'{}' is not a document store of version {}".format(addr, VERSION))
+        self.doc_ids = _from_bytes('I', self.mm[table_off:table_off + 4 * n_docs])
+        table_off += 4 * n_docs
+        self.offsets = _from_bytes('Q', self.mm[table_off:table_off + 8 * n_docs])
+        table_off += 8 * n_docs
+        self.lengths = _from_bytes('I', self.mm[table_off:table_off + 4 * n_docs])
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __find(self, doc_id:str) -> int:
+        doc_id = int(doc_id)
+        i = bisect_left(self.doc_ids, doc_id)
+        return i if i < len(self.doc_ids) and self.doc_ids[i] == doc_id else -1
+
+    def __contains__(self, doc_id:str) -> bool:
+        return self.__find(doc_id) >= 0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    # compressed doc, None if doc is not in store
+    def blob(self, doc_id:str) -> bytes:
+        i = self.__find(doc_id)
+        if i < 0:
+            return None
+        return self.mm[self.offsets[i]:self.offsets[i] + self.lengths[i]]
+
+    # {'title', 'content', 'url'} of a doc, None if doc is not in store
+    def get(self, doc_id:str) -> dict:
+        blob = self.blob(doc_id)
+        if blob is None:
+            return None
+        return json.loads(zlib.decompress(blob).decode('utf-8'))
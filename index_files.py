@@ -0,0 +1,50 @@
+import os
+
+# Addresses of the files written next to an index file
+
+# Champions lists of an index: './index.json' -> './index.champions.json'
+def champions_addr(index_addr:str) -> str:
+    root, ext = os.path.splitext(index_addr)
+    return root + '.champions' + ext
+
+# Manifest of delta segments of an index: './index.json' -> './index.segments.json'
+def segments_addr(index_addr:str) -> str:
+    root, _ = os.path.splitext(index_addr)
+    return root + '.segments.json'
+
+# File of a delta segment (index or refined db): './index.json' -> './index.delta1.json'
+def segment_addr(addr:str, name:str) -> str:
+    root, ext = os.path.splitext(addr)
+    return root + '.' + name + ext
+
+# Tombstone bitmap of a segment ('base' is the main index): './index.json' -> './index.base.tombstones'
+def tombstones_addr(index_addr:str, name:str) -> str:
+    root, _ = os.path.splitext(index_addr)
+    return root + '.' + name + '.tombstones'
+
+# Manifest of shards of an index: './index.json' -> './index.shards.json'
+# files of shard i are segment files named 'shard<i>': './index.shard0.json', './refined_db.shard0.json'
+def shards_addr(index_addr:str) -> str:
+    root, _ = os.path.splitext(index_addr)
+    return root + '.shards.json'
+
+# Document store of a refined db (titles, urls and contents): './refined_db.json' -> './refined_db.docs'
+# stores of segments and shards are next to their refined dbs: './refined_db.delta1.docs'
+def docs_addr(refined_db_addr:str) -> str:
+    root, _ = os.path.splitext(refined_db_addr)
+    return root + '.docs'
+
+# Stop words and corpus statistics of an index: './index.json' -> './index.stats.json'
+def stats_addr(index_addr:str) -> str:
+    root, _ = os.path.splitext(index_addr)
+    return root + '.stats.json'
+
+# Tier 1 of a tiered index (postings with highest tf*idf): './index.json' -> './index.tier1.json'
+def tier1_addr(index_addr:str) -> str:
+    root, ext = os.path.splitext(index_addr)
+    return root + '.tier1' + ext
+
+# Manifest of tiers of an index (upper bounds of tier 2 per term): './index.json' -> './index.tiers.json'
+def tiers_addr(index_addr:str) -> str:
+    root, _ = os.path.splitext(index_addr)
+    return root + '.tiers.json'
@@ -1,31 +1,110 @@
-import json
-from typing import List
-from heapq import heappop, heappush, heapify
-from hazm import Normalizer, Lemmatizer, word_tokenize
+import json, math, os, threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from itertools import islice
+from multiprocessing import Pool
+from heapq import nlargest
+from binary_index import BinaryIndex, is_binary_index, write_binary_index
+from doc_store import DocStore, DocStoreWriter, is_doc_store
+from postings import CompactIndex, TermStream
+from text_processor import TextProcessor
+from json_stream import iter_json_object
+from metrics import MetricsRegistry, clock, lap
+from index_files import champions_addr, docs_addr, segments_addr, segment_addr, shards_addr, stats_addr, tier1_addr, tiers_addr, tombstones_addr
+from segments import load_manifest, save_manifest, save_tombstones, is_deleted, mark_deleted, base_addr, segment_tombstones_addr, load_segment_tombstones
+
+# Appends terms of a doc to index -> postings of term: doc id, tf and positions (in shared positions buffer)
+# stop words are not indexed, other terms keep their positions
+def invert_document(index:CompactIndex, doc_id:str, terms:List[str], stop_words:Set[str]=frozenset()):
+    index.add_document(int(doc_id), terms, stop_words)
+
+# Indexer of each worker process (parallel indexing)
+# forked workers inherit it from parent, other workers build their own tools
+_worker_indexer = None
+
+def _init_worker(enable_normalizer:bool):
+    global _worker_indexer
+    if _worker_indexer is None:
+        _worker_indexer = Indexer(None, None, None, 0, enable_normalizer)
+    # a forked worker also inherits the parent's counters, they are already counted by the parent
+    _worker_indexer.text_processor.take_stats()
+
+# Processes docs of a shard -> (terms of its docs, {doc_id: t_count}, text processing stats)
+def _process_shard(shard:List[Tuple[str, str]]) -> Tuple[TermStream, Dict[str, int], Dict[str, float]]:
+    term_stream = TermStream()
+    t_counts = dict()
+    for id, content in shard:
+        new_tokens = _worker_indexer.process_document(content)
+        t_counts[id] = len(new_tokens)
+        term_stream.add_document(id, new_tokens)
+    return term_stream, t_counts, _worker_indexer.text_processor.take_stats()
 
 # This is the indexer class
 # It handles everything related to indexing!
 class Indexer:
 
     # Initializer index
-    def __init__(self, load_addr:str, save_addr:str, refined_db_addr:str, remove_x_sw:int, enable_normalizer:bool=True, debug_mode = False) -> None:
+    def __init__(self, load_addr:str, save_addr:str, refined_db_addr:str, remove_x_sw:int, enable_normalizer:bool=True, debug_mode = False, index_format:str='json', workers:int=1, chunk_size:int=500, streaming:bool=False, champions_size:int=0, champions_order:str='tf', shards:int=1, tier1_fraction:float=0.0) -> None:
         # Indexer config
         self.load_addr = load_addr
         self.save_addr = save_addr
         self.refined_db_addr = refined_db_addr
         self.remove_x_sw = remove_x_sw              # remove x most frequent words
         self.db = None                              # loading db into db
-        self.refined_db = dict()                    # after reading db - we create refined from docs
-        self.index = dict()                         # building index using dict as base data structure
+        self.refined_db = dict()                    # after reading db - we create refined from docs (statistics of docs)
+        self.doc_stores = []                        # writers of document stores (one per shard), docs are written while they are read
+        self.index = CompactIndex()                 # building index: arrays of doc ids, tfs and positions offsets per term
         self.enable_normalizer = enable_normalizer  # enabling normalizer
         self.DEBUG = debug_mode         
+        self.index_format = index_format            # 'json' or 'binary' (compact, memory-mapped by search engine)
+        self.workers = max(1, workers)              # number of indexing processes, 1 means serial indexing
+        self.chunk_size = max(1, chunk_size)        # number of docs in each shard of parallel indexing
+        self.streaming = streaming                  # read docs one by one, db is not loaded into memory
+        self.champions_size = champions_size        # r docs per term in champions lists, 0 means no champions lists
+        self.champions_order = champions_order      # champions are top docs by 'tf' or by 'score' (normalized weight)
+        self.champions_list = CompactIndex()
+        self.shards = max(1, shards)                # number of index shards, docs go to shard int(doc_id) % shards
+        self.tier1_fraction = tier1_fraction        # fraction of postings (highest tf*idf) in tier 1, 0 means no tiers
+        self.tiers = []                             # [tier 1, tier 2 (the rest)] of tiered index
         
         # setup tools here
-        self.normalizer = Normalizer().normalize
-        self.stemmer = Lemmatizer().lemmatize
-        self.tokenizer = word_tokenize
-        self.useless_notations = ['_' ,'-', '+', '*', '%', '$', '/', '.', '!', '(', ')', '^', '=', '<', '>', '?', '&', '@', '\\', ';', '\'', '\"', '{', '}', '[', ']', ':', '«', '»', ','] # useless notations
-        self.stop_words = []
+        self.text_processor = TextProcessor(enable_normalizer)  # normalizer, tokenizer and memoized lemmatizer
+        self.stop_words = []                        # removed most frequent terms, delta segments drop them too
+        self.term_stream = None                     # terms of processed docs (first pass), inverted after stop words are chosen
+        self.segments_lock = threading.Lock()       # add/delete/merge of segments run one at a time
+        self.base_doc_ids = None                    # doc ids of base index (loaded on first update)
+        self.metrics = None                         # MetricsRegistry of stage times (None: disabled)
+
+    # Returns refined version of a doc: its statistics only, title, content and url go to document store
+    def __refined_doc(self) -> dict:
+        return {
+            "t_count": 0
+        }
+
+    # Adds a read doc to refined db and to document store of its shard
+    def __add_doc(self, id:str, doc:dict):
+        self.refined_db[id] = self.__refined_doc()
+        self.doc_stores[int(id) % len(self.doc_stores)].add(id, doc)
+
+    # Opens document store writers: one next to refined db, or one per shard
+    def __open_doc_stores(self):
+        self.__discard_doc_stores()
+        if self.shards > 1:
+            addrs = [docs_addr(segment_addr(self.refined_db_addr, 'shard{}'.format(i))) for i in range(self.shards)]
+        else:
+            addrs = [docs_addr(self.refined_db_addr)]
+        self.doc_stores = [DocStoreWriter(addr) for addr in addrs]
+
+    def __close_doc_stores(self):
+        for doc_store in self.doc_stores:
+            doc_store.close()
+        self.doc_stores = []
+
+    # drops unfinished document stores (indexing failed)
+    def __discard_doc_stores(self):
+        for doc_store in self.doc_stores:
+            doc_store.discard()
+        self.doc_stores = []
 
     # Load Database (a json files here)
     def __load_db(self):
@@ -38,17 +117,7 @@ class Indexer:
                     self.db[id] = {
                         "content" : data[id]['content'],
                     }
-                    shortened_content = ''
-                    if len(data[id]['content']) > 200:
-                        shortened_content = data[id]['content'][:200] + '...'
-                    else:
-                        shortened_content = data[id]['content']
-                    self.refined_db[id] = {
-                        "title": data[id]['title'],
-                        "content" : shortened_content ,
-                        "url" : data[id]['url'],
-                        "t_count": 0
-                    }
+                    self.__add_doc(id, data[id])
                     count += 1
                 print('Max Docs:', count)
                 return
@@ -63,172 +132,657 @@ class Indexer:
             print("error:", e)
         self.db = None       
 
-    # Save index file
-    def __save_index(self):
+    # Streams Database doc by doc with an incremental json parser -> (doc_id, content)
+    # contents are not kept, only refined db and document store are filled
+    def __stream_db(self) -> Iterator[Tuple[str, str]]:
+        count = 0
+        with open(self.load_addr, 'r', encoding='utf-8') as file:
+            for id, doc in iter_json_object(file):
+                self.__add_doc(id, doc)
+                count += 1
+                yield id, doc['content']
+        print('Max Docs:', count)
+
+    # Writes an index in index format
+    # it is written to a temp file first, so a search engine loading it never sees a half written file
+    def __write_index(self, index:CompactIndex, addr:str):
+        if self.index_format == 'binary':
+            write_binary_index(index, addr + '.tmp')
+        else:
+            with open(addr + '.tmp', 'w', encoding='UTF-8') as file:
+                index.write_json(file)
+        os.replace(addr + '.tmp', addr)
+
+    # Writes a refined db (temp file first, like index)
+    def __write_refined_db(self, refined_db:dict, addr:str):
+        with open(addr + '.tmp', 'w', encoding='UTF-8') as file2:
+            json.dump(refined_db, file2,  indent=2 ,ensure_ascii=False)
+        os.replace(addr + '.tmp', addr)
+
+    # Save index file (and files next to it) at index_addr and refined db at refined_db_addr
+    def __save_index(self, index_addr:str, refined_db_addr:str):
         
-        with open(self.save_addr, 'w', encoding='UTF-8') as file:
-            json.dump(self.index, file, indent=2, ensure_ascii=False)
-
-        with open(self.refined_db_addr, 'w', encoding='UTF-8') as file2:
-            json.dump(self.refined_db, file2,  indent=2 ,ensure_ascii=False)
-
-    # Normalizer is used to process contents and normalizing the text for that content 
-    def __normalizer(self, content:str) -> str:
-        if not self.enable_normalizer: return content
-        content = self.normalizer(content)
-        res = ''
-        for c in content:
-            if c in self.useless_notations:
-                res = res + ' '
-            else:
-                res = res + c
-        return res
-
-    # This function is used for tokenization
-    def __tokenizer(self, content:str)->List[str]:
-        return self.tokenizer(content)
-
-    # This function is used for stemming
-    def __stemmer(self, term:str) -> str:
-        stem = self.stemmer(term)
-        if len(stem) == 0:
-            # return term
-            return ''
-        else: 
-            return stem
+        self.__write_index(self.index, index_addr)
+        if self.champions_size > 0:
+            self.__write_index(self.champions_list, champions_addr(index_addr))
+        self.__write_tiers(self.tiers, index_addr)
+
+        self.__write_refined_db(self.refined_db, refined_db_addr)
+        save_manifest(stats_addr(index_addr), self.__corpus_statistics())
+
+    # Writes tier 1 as an index and upper bounds of tier 2 per term (max tf, max normalized weight) in tiers manifest
+    # tier 2 postings are not written: they are the postings of index which are not in tier 1
+    # files of an older tiered index are removed when tiers are disabled
+    def __write_tiers(self, tiers:List[CompactIndex], addr:str):
+        if len(tiers) == 0:
+            for old_addr in (tier1_addr(addr), tiers_addr(addr)):
+                if os.path.exists(old_addr):
+                    os.remove(old_addr)
+            return
+        self.__write_index(tiers[0], tier1_addr(addr))
+        save_manifest(tiers_addr(addr), {
+            'tier1_fraction': self.tier1_fraction,
+            'tier2_bounds': {term: [entry.max_tf, entry.max_nw] for term, entry in tiers[1].terms.items()},
+        })
+
+    # Stop words and corpus statistics: docs, tokens, vocabulary size (stop words included), indexed terms
+    # and df histogram (df -> number of terms with that df)
+    def __corpus_statistics(self) -> dict:
+        df_histogram = dict()
+        for entry in self.index.terms.values():
+            df_histogram[entry.df] = df_histogram.get(entry.df, 0) + 1
+        return {
+            'docs': len(self.refined_db),
+            'tokens': sum(doc['t_count'] for doc in self.refined_db.values()),
+            'vocabulary_size': len(self.index) + len(self.stop_words),
+            'terms': len(self.index),
+            'stop_words': self.stop_words,
+            'df_histogram': {str(df): df_histogram[df] for df in sorted(df_histogram)},
+        }
+
+    # Splits an index into shards by doc id: postings of a doc go to shard int(doc_id) % shards
+    # df and idf stay global, so scores of shards are the scores of the whole index
+    def __split_index(self, index:CompactIndex, norms:Dict[int, float]) -> List[CompactIndex]:
+        selected = [dict() for _ in range(self.shards)]
+        for term, entry in index.terms.items():
+            for i in range(len(entry.doc_ids)):
+                shard = entry.doc_ids[i] % self.shards
+                if term not in selected[shard]:
+                    selected[shard][term] = []
+                selected[shard][term].append(i)
+        shard_indexes = [index.subset(selected[i]) for i in range(self.shards)]
+        for shard_index in shard_indexes:
+            self.__set_max_nw(shard_index, norms)
+        return shard_indexes
+
+    # Save index as shards: index, champions lists and refined db of each shard, and manifest of shards
+    # manifest keeps global idf of terms (query norm of cosine is the same in all shards)
+    def __save_shards(self):
+        names = ['shard{}'.format(i) for i in range(self.shards)]
+        norms = {int(doc_id): self.refined_db[doc_id]['norm'] for doc_id in self.refined_db}
+        shard_indexes = self.__split_index(self.index, norms)
+        for i in range(self.shards):
+            self.__write_index(shard_indexes[i], segment_addr(self.save_addr, names[i]))
+        if self.champions_size > 0:
+            shard_champions = self.__split_index(self.champions_list, norms)
+            for i in range(self.shards):
+                self.__write_index(shard_champions[i], champions_addr(segment_addr(self.save_addr, names[i])))
+        shard_tiers = [[] for _ in range(self.shards)]
+        for tier in self.tiers:
+            for i, shard_tier in enumerate(self.__split_index(tier, norms)):
+                shard_tiers[i].append(shard_tier)
+        for i in range(self.shards):
+            self.__write_tiers(shard_tiers[i], segment_addr(self.save_addr, names[i]))
+        shard_dbs = [dict() for _ in range(self.shards)]
+        for doc_id in self.refined_db:
+            shard_dbs[int(doc_id) % self.shards][doc_id] = self.refined_db[doc_id]
+        for i in range(self.shards):
+            self.__write_refined_db(shard_dbs[i], segment_addr(self.refined_db_addr, names[i]))
+        save_manifest(shards_addr(self.save_addr), {
+            'shards': names,
+            'max_doc': len(self.refined_db),
+            'index_format': self.index_format,
+            'idf': {term: entry.idf for term, entry in self.index.terms.items()},
+            'stop_words': self.stop_words,
+        })
+        save_manifest(stats_addr(self.save_addr), self.__corpus_statistics())
 
     # Use this function to extract you stop word list!
     # You can disable this feature!
-    def __remove_sw(self):
-        heap = []
-        heapify(heap)
-        for term in list(self.index.keys()):
-            heappush(heap, (-1 * int(self.index[term]['freq']), term))
-
-        max_element = len(heap)
+    # x most frequent terms are chosen from term frequencies of first pass, so their postings are never built
+    def __select_stop_words(self):
+        stop_words = self.term_stream.most_frequent(self.remove_x_sw)
         if self.DEBUG and self.remove_x_sw >= 10 : print('Here you can see 10 first stop words:')
-        for i in range(self.remove_x_sw):
-            if i >= max_element:
-                return
-            item = heappop(heap)
+        for i in range(len(stop_words)):
             if self.DEBUG and i < 10:
-                print("{}-term: {}, freq: {}".format(i, item[1], item[0] * -1))
-            self.index.pop(item[1])
+                print("{}-term: {}, freq: {}".format(i, stop_words[i][0], stop_words[i][1]))
+            self.stop_words.append(stop_words[i][0])
 
-    # Do indexing operation here
-    def __indexer_engine(self):
-
-        # *********************** This are is for tokenization process:
-        tokens = []
-        show_one_sample = True
-        for id in self.db:
-            # First: Normalize Content
-            if show_one_sample and self.DEBUG:
-                print('First Content Before Normalization:{}'.format(self.db[id]['content']))
-            content = self.__normalizer(self.db[id]['content'])
-            if show_one_sample and self.DEBUG:
-                print('After Normalization: {}'.format(content))
-            # Second: Tokenizing
-            tks = self.__tokenizer(content)
-            if show_one_sample and self.DEBUG:
-                print('After Tokenization: ', tks)
-            new_tokens = []
-            # Third: Stemming the tokens
-            for t in tks:
-                stem = self.__stemmer(t)
-                if stem == '':
-                    continue
-                new_tokens.append(stem)
-
-            if show_one_sample and self.DEBUG:
-                print('After Stemming Terms in Tokens:', new_tokens)
+    # Computes statistics used for scoring:
+    # index[term] -> df, idf=log10(N/df), max_nw=max(log10(1+tf)/norm) over its docs
+    # refined_db[doc_id] -> norm=L2 norm of (log10(1+tf)) over all terms of doc
+    def __compute_statistics(self, index:CompactIndex, refined_db:dict):
+        max_doc = len(refined_db)
+        squares = dict()
+        for entry in index.terms.values():
+            for doc_id, tf in zip(entry.doc_ids, entry.tfs):
+                w = math.log10(1 + tf)
+                squares[doc_id] = squares.get(doc_id, 0.0) + w * w
+        norms = dict()
+        for doc_id in refined_db:
+            norms[int(doc_id)] = math.sqrt(squares.get(int(doc_id), 0.0))
+            refined_db[doc_id]['norm'] = norms[int(doc_id)]
+        for entry in index.terms.values():
+            entry.df = len(entry.doc_ids)
+            entry.idf = math.log10(max_doc/entry.df)
+        self.__set_max_nw(index, norms)
+
+    # max normalized weight of each term: max(log10(1+tf)/norm) over its docs
+    def __set_max_nw(self, index:CompactIndex, norms:Dict[int, float]):
+        for entry in index.terms.values():
+            max_nw = 0.0
+            for doc_id, tf in zip(entry.doc_ids, entry.tfs):
+                max_nw = max(max_nw, math.log10(1 + tf) / norms[doc_id])
+            entry.max_nw = max_nw
+
+    # Builds champions lists: top champions_size postings of each term, sorted by doc id
+    # order 'tf' keeps docs with the highest tf, order 'score' keeps docs with the highest normalized weight (cosine)
+    # equal values keep lower doc ids; freq, df and idf stay the ones of the full index
+    def __build_champions_list(self):
+        norms = {int(doc_id): self.refined_db[doc_id]['norm'] for doc_id in self.refined_db}
+        selected = dict()
+        for term, entry in self.index.terms.items():
+            doc_ids = entry.doc_ids
+            tfs = entry.tfs
+            top = range(len(doc_ids))
+            if len(doc_ids) > self.champions_size:
+                if self.champions_order == 'score':
+                    key = lambda i: (math.log10(1 + tfs[i]) / norms[doc_ids[i]], -doc_ids[i])
+                else:
+                    key = lambda i: (tfs[i], -doc_ids[i])
+                top = sorted(nlargest(self.champions_size, top, key=key))
+            selected[term] = list(top)
+        self.champions_list = self.index.subset(selected)
+        for term, entry in self.champions_list.terms.items():
+            entry.freq = self.index.terms[term].freq
+        self.__set_max_nw(self.champions_list, norms)
+
+    # Builds tiers: tier 1 holds postings with the highest impact (tf*idf = log10(1+tf)*idf) of whole index,
+    # tier1_fraction of all postings (postings equal to the lowest impact in tier 1 are in it too); tier 2 is the rest
+    # common terms have low idf, so most of their postings are in tier 2
+    def __build_tiers(self):
+        impacts = array('d')
+        for entry in self.index.terms.values():
+            impacts.extend(math.log10(1 + tf) * entry.idf for tf in entry.tfs)
+        self.tiers = []
+        if len(impacts) == 0:
+            return
+        threshold = nlargest(max(1, math.ceil(len(impacts) * self.tier1_fraction)), impacts)[-1]
+        tier1 = dict()
+        tier2 = dict()
+        for term, entry in self.index.terms.items():
+            for i in range(len(entry.tfs)):
+                tier = tier1 if math.log10(1 + entry.tfs[i]) * entry.idf >= threshold else tier2
+                if term not in tier:
+                    tier[term] = []
+                tier[term].append(i)
+        norms = {int(doc_id): self.refined_db[doc_id]['norm'] for doc_id in self.refined_db}
+        self.tiers = [self.index.subset(tier1), self.index.subset(tier2)]
+        for tier in self.tiers:
+            self.__set_max_nw(tier, norms)
+
+    # Runs normalizer, tokenizer and stemmer on a document content and returns its terms
+    def process_document(self, content:str, show_sample:bool=False) -> List[str]:
+        if not show_sample:
+            return self.text_processor.process(content)
+        # First: Normalize Content
+        print('First Content Before Normalization:{}'.format(content))
+        content = self.text_processor.normalize(content)
+        print('After Normalization: {}'.format(content))
+        # Second: Tokenizing
+        tks = self.text_processor.tokenize(content)
+        print('After Tokenization: ', tks)
+        # Third: Stemming the tokens
+        new_tokens = []
+        for t in tks:
+            stem = self.text_processor.stem(t)
+            if stem == '':
+                continue
+            new_tokens.append(stem)
+        print('After Stemming Terms in Tokens:', new_tokens)
+        return new_tokens
 
+    # Sorts index by term and postings lists by doc id, sort also recomputes max tf of each term
+    def __sort_index(self, index:CompactIndex) -> CompactIndex:
+        index.sort()
+        return index
+
+    # Tokenizes docs one by one in this process, their terms are appended to term stream as ids
+    def __serial_processing(self, docs:Iterable[Tuple[str, str]]):
+        show_one_sample = self.DEBUG
+        for id, content in docs:
+            new_tokens = self.process_document(content, show_one_sample)
             self.refined_db[id]['t_count'] = len(new_tokens)
-            
-            # Forth: Appending new tokens to the tokens list
-            for item in new_tokens:
-                if item == '':
-                    continue
-                tokens.append({'doc_id': id, 'token':item})
-            
-            if show_one_sample and self.DEBUG:
-                print('Making tokens ready for indexing {term, doc_id}: ', tokens)
-                
+            # Forth: Appending new tokens to the term stream
+            self.term_stream.add_document(id, new_tokens)
+            if show_one_sample:
+                print('Some of tokens ready to index {term, doc_id}: ', [{'doc_id': id, 'token': t} for t in new_tokens[:10]])
             show_one_sample = False
-            
-        # Test Area
+
+    # Splits docs into shards of chunk_size docs and processes them in a process pool
+    # term streams of shards are merged in doc-ID order, so the result is the same as serial processing
+    # only 2 shards per worker are read ahead, so docs can be streamed
+    def __parallel_processing(self, docs:Iterable[Tuple[str, str]]):
+        docs = iter(docs)
+        shards = iter(lambda: list(islice(docs, self.chunk_size)), [])
         if self.DEBUG:
-            if len(tokens) >= 10:
-                print("Some of tokens ready to index:", tokens[:10])
-            else:
-                print("Some of tokens ready to index:", tokens)
+            print('Processing shards of {} docs with {} workers'.format(self.chunk_size, self.workers))
+        global _worker_indexer
+        _worker_indexer = self
+        try:
+            with Pool(self.workers, initializer=_init_worker, initargs=(self.enable_normalizer,)) as pool:
+                while True:
+                    window = list(islice(shards, 2 * self.workers))
+                    if len(window) == 0:
+                        break
+                    for term_stream, t_counts, stats in pool.imap(_process_shard, window):
+                        for id in t_counts:
+                            self.refined_db[id]['t_count'] = t_counts[id]
+                        self.term_stream.merge(term_stream)
+                        self.text_processor.add_stats(stats)
+        finally:
+            _worker_indexer = None
 
+    # Observes text processing stage times (normalize, tokenize, stem) since stats before
+    def __observe_text_processing(self, stats_before:Dict[str, float]):
+        if self.metrics is None:
+            return
+        stats = self.text_processor.stats()
+        for stage in ('normalize', 'tokenize', 'stem'):
+            self.metrics.observe('indexer.' + stage, stats[stage + '_time'] - stats_before[stage + '_time'])
+        self.metrics.inc('indexer.docs', stats['documents'] - stats_before['documents'])
+        self.metrics.inc('indexer.tokens', stats['tokens'] - stats_before['tokens'])
+
+    # Do indexing operation here
+    def __indexer_engine(self, docs:Iterable[Tuple[str, str]]):
+
+        # *********************** This are is for tokenization process (first pass):
+        # terms of docs are kept as ids with their frequencies, postings are built after stop words are known
+        text_stats = self.text_processor.stats()
+        self.term_stream = TermStream()
+        if self.workers > 1:
+            self.__parallel_processing(docs)
+        else:
+            self.__serial_processing(docs)
         # *********************** end of tokenization
-        
-        # ####################### This are is for indexing process:
-        last_doc_id = '-1'
-        position = 0
-        for item in tokens:
-
-            doc_id = item['doc_id']
-            token = item['token']
-            
-            if last_doc_id != doc_id:
-                position = 0
-                last_doc_id = doc_id
-            
-            position += 1
-            
-            if token in self.index:
-                temp_obj = self.index[token]
-                new_freq = temp_obj['freq'] + 1
-                postings_list = temp_obj['postings_list']
-                if doc_id not in postings_list:
-                    postings_list[doc_id] = {'tf':1, 'positions':[position]}
-                else:
-                    postings_list[doc_id]['tf'] = postings_list[doc_id]['tf'] + 1
-                    pl = postings_list[doc_id]['positions']
-                    pl.append(position)
-                    postings_list[doc_id]['positions'] = pl
-                self.index[token]['freq'] = new_freq
-                self.index[token]['postings_list'] = postings_list
-            else:
-                # we have a term freq - and term/doc freq in postings
-                self.index[token] = {'freq': 1, 'postings_list': {doc_id:{'tf':1, 'positions':[position]}}}
-
-        # sorting dictionary by term
-        self.index = dict(sorted(self.index.items()))
-        for term in self.index:
-            pl = list(self.index[term]['postings_list'].keys())
-            pl_int = [int(x) for x in pl]
-            pl_int.sort()
-            new_pl = dict()
-            for x in pl_int:
-                x_str = str(x)
-                new_pl[x_str] = self.index[term]['postings_list'][x_str]
-            self.index[term]['postings_list'] = new_pl
-            
-                
 
         # remove X most frequent words
+        t = clock(self.metrics)
+        self.stop_words = []
         if self.remove_x_sw > 0:
-            self.__remove_sw()
+            self.__select_stop_words()
+        t = lap(self.metrics, 'indexer.stop_words', t)
+
+        # ####################### This are is for indexing process (second pass): stop words are skipped
+        # postings are built here, not in workers: sending partial indexes back costs about as much as building them
+        # term ids of the whole corpus are kept until here (4 bytes per token, freed after inverting)
+        self.index = CompactIndex()
+        self.term_stream.invert(self.index, set(self.stop_words))
+        self.term_stream = None
+        t = lap(self.metrics, 'indexer.invert', t)
+        self.__observe_text_processing(text_stats)
+
+        # ####################### This are is for sorting process:
+        self.index = self.__sort_index(self.index)
+        t = lap(self.metrics, 'indexer.sort', t)
+
+        # df, idf, doc norms and max normalized weights, so search engine does not compute them per query
+        self.__compute_statistics(self.index, self.refined_db)
+        t = lap(self.metrics, 'indexer.statistics', t)
+
+        # top r docs of each term, saved next to index
+        if self.champions_size > 0:
+            self.__build_champions_list()
+            t = lap(self.metrics, 'indexer.champions', t)
+
+        # tier 1 (high impact postings) and upper bounds of the rest, for early termination in search engine
+        self.tiers = []
+        if self.tier1_fraction > 0:
+            self.__build_tiers()
+            t = lap(self.metrics, 'indexer.tiers', t)
+        if self.metrics is not None:
+            self.metrics.inc('indexer.terms', len(self.index))
 
 
         
         if self.DEBUG:
             print("Number of extracted terms in dict: {}".format(len(list(self.index.keys()))))
+            print("Text processing stats: {}".format(self.text_processor.stats()))
 
         # ####################### end of indexing
 
+    # ####################### Incremental updates:
+    # new docs are indexed into small delta segments next to the index, deleted docs are marked in the
+    # tombstone bitmap of the segment holding them; search engine reads base index and deltas together
+    # merge_segments() compacts them into a new base index. Updates use config of the saved index (manifest).
+
+    # Commits the manifest of a freshly built index, its old base and segments are retired
+    # base is the generation name of base files (merged index), None for files at index address (run())
+    # run() rewrites files at index address in place: readers are expected to reload after a full build
+    def __reset_segments(self, base:str=None):
+        old = load_manifest(segments_addr(self.save_addr))
+        manifest = {
+            'segments': [],
+            'next_segment': 1,
+            'max_doc': len(self.refined_db),
+            'stop_words': self.stop_words,
+            'index_format': self.index_format,
+            'champions_size': self.champions_size,
+            'champions_order': self.champions_order,
+            'tier1_fraction': self.tier1_fraction,
+            'generation': 0,
+            'base': base,
+            'tombstones': dict(),
+        }
+        old_files, stale = [], []
+        if old is not None:
+            # names of segments are not reused, retired files of old segments may still be read
+            manifest['next_segment'] = old['next_segment']
+            manifest['generation'] = old.get('generation', 0)
+            old_files, stale = self.__manifest_files(old), old.get('retired', [])
+        self.__commit_manifest(manifest, old_files, stale)
+        self.base_doc_ids = set(self.refined_db.keys())
+
+    # Name of a file written by the next update: 'base' -> 'base.g3'
+    def __generation_name(self, manifest:dict, name:str) -> str:
+        return '{}.g{}'.format(name, manifest.get('generation', 0) + 1)
+
+    # Files of base index and segments listed in a manifest (some of them may not exist)
+    def __manifest_files(self, manifest:dict) -> List[str]:
+        index_addr = base_addr(self.save_addr, manifest)
+        refined_db_addr = base_addr(self.refined_db_addr, manifest)
+        addrs = [index_addr, champions_addr(index_addr), tier1_addr(index_addr), tiers_addr(index_addr), stats_addr(index_addr),
+                 refined_db_addr, docs_addr(refined_db_addr)]
+        for segment in manifest['segments']:
+            addrs.append(segment_addr(self.save_addr, segment['name']))
+            addrs.append(segment_addr(self.refined_db_addr, segment['name']))
+            addrs.append(docs_addr(segment_addr(self.refined_db_addr, segment['name'])))
+        for name in ['base'] + [segment['name'] for segment in manifest['segments']]:
+            addr = segment_tombstones_addr(self.save_addr, manifest, name)
+            if addr is not None:
+                addrs.append(addr)
+        return addrs
+
+    # Saves manifest: the single switch of an update, readers see all of its files or none of them
+    # files of the old manifest (old_files) which are not listed anymore are retired, and files retired
+    # by the previous update (stale) are removed now
+    def __commit_manifest(self, manifest:dict, old_files:List[str], stale:List[str]):
+        addrs = set(self.__manifest_files(manifest))
+        manifest['generation'] = manifest.get('generation', 0) + 1
+        manifest['retired'] = [addr for addr in old_files if addr not in addrs]
+        save_manifest(segments_addr(self.save_addr), manifest)
+        for addr in stale:
+            if addr not in addrs:
+                try:
+                    os.remove(addr)
+                except FileNotFoundError:
+                    pass
+
+    # Loads manifest of saved index and takes its config, None if index was not built by run()
+    def __load_manifest(self):
+        manifest = load_manifest(segments_addr(self.save_addr))
+        if manifest is None:
+            print("no index manifest in {}, run() indexer first.".format(segments_addr(self.save_addr)))
+            return None
+        self.index_format = manifest['index_format']
+        self.champions_size = manifest['champions_size']
+        self.champions_order = manifest['champions_order']
+        self.tier1_fraction = manifest.get('tier1_fraction', 0.0)
+        self.stop_words = manifest['stop_words']
+        if self.base_doc_ids is None:
+            with open(base_addr(self.refined_db_addr, manifest), 'r', encoding='utf-8') as file:
+                self.base_doc_ids = set(json.load(file).keys())
+        return manifest
+
+    # Returns name of the segment holding live version of a doc ('base' is the main index), None if doc is not live
+    def __find_live_doc(self, manifest:dict, tombstones:Dict[str, bytearray], id:str):
+        for segment in reversed(manifest['segments']):
+            if id in segment['docs']:
+                return segment['name'] if not is_deleted(tombstones[segment['name']], int(id)) else None
+        if id in self.base_doc_ids and not is_deleted(tombstones['base'], int(id)):
+            return 'base'
+        return None
+
+    # Marks live versions of docs as deleted -> segment names of deleted docs (tombstones are not saved here)
+    def __delete(self, manifest:dict, tombstones:Dict[str, bytearray], ids:Iterable[str]) -> List[str]:
+        names = []
+        for id in ids:
+            name = self.__find_live_doc(manifest, tombstones, id)
+            if name is not None:
+                mark_deleted(tombstones[name], int(id))
+                names.append(name)
+        manifest['max_doc'] -= len(names)
+        return names
+
+    def __load_all_tombstones(self, manifest:dict) -> Dict[str, bytearray]:
+        names = ['base'] + [segment['name'] for segment in manifest['segments']]
+        return {name: load_segment_tombstones(self.save_addr, manifest, name) for name in names}
+
+    # Writes tombstones of changed segments as new files and lists them in manifest (saved by the caller)
+    # tombstones of older manifests are at tombstones_addr(index, segment name), they are listed first
+    def __save_all_tombstones(self, manifest:dict, tombstones:Dict[str, bytearray], names:Iterable[str]):
+        if 'tombstones' not in manifest:
+            manifest['tombstones'] = {name: name for name in tombstones if any(tombstones[name])}
+        for name in set(names):
+            file = self.__generation_name(manifest, name)
+            save_tombstones(tombstones_addr(self.save_addr, file), tombstones[name])
+            manifest['tombstones'][name] = file
+
+    # Adds docs ({doc_id: {'title', 'content', 'url'}}) to index as a new delta segment
+    # docs that are already in index are re-indexed: their old version is deleted
+    def add_documents(self, docs:Dict[str, dict]) -> int:
+        t = clock(self.metrics)
+        with self.segments_lock:
+            manifest = self.__load_manifest()
+            if manifest is None or len(docs) == 0:
+                return 0
+            old_files, stale = self.__manifest_files(manifest), manifest.get('retired', [])
+            tombstones = self.__load_all_tombstones(manifest)
+            deleted = self.__delete(manifest, tombstones, docs)
+            name = 'delta{}'.format(manifest['next_segment'])
+            index = CompactIndex()
+            refined_db = dict()
+            doc_store = DocStoreWriter(docs_addr(segment_addr(self.refined_db_addr, name)))
+            for id in docs:
+                new_tokens = self.process_document(docs[id]['content'])
+                refined_db[id] = self.__refined_doc()
+                refined_db[id]['t_count'] = len(new_tokens)
+                doc_store.add(id, docs[id])
+                # stop words of base index are not indexed (they keep their positions like in base)
+                invert_document(index, id, new_tokens, set(self.stop_words))
+            index = self.__sort_index(index)
+            self.__compute_statistics(index, refined_db)
+            self.__write_index(index, segment_addr(self.save_addr, name))
+            self.__write_refined_db(refined_db, segment_addr(self.refined_db_addr, name))
+            doc_store.close()
+            manifest['segments'].append({'name': name, 'docs': list(docs)})
+            manifest['next_segment'] += 1
+            manifest['max_doc'] += len(docs)
+            self.__save_all_tombstones(manifest, tombstones, deleted)
+            self.__commit_manifest(manifest, old_files, stale)
+            if self.DEBUG:
+                print("{} docs added in segment '{}', live docs: {}".format(len(docs), name, manifest['max_doc']))
+        lap(self.metrics, 'indexer.add_documents', t)
+        return len(docs)
+
+    # Deletes docs from index -> number of deleted docs
+    def delete_documents(self, ids:Iterable[str]) -> int:
+        with self.segments_lock:
+            manifest = self.__load_manifest()
+            if manifest is None:
+                return 0
+            old_files, stale = self.__manifest_files(manifest), manifest.get('retired', [])
+            tombstones = self.__load_all_tombstones(manifest)
+            deleted = self.__delete(manifest, tombstones, [str(id) for id in ids])
+            if len(deleted) > 0:
+                self.__save_all_tombstones(manifest, tombstones, deleted)
+                self.__commit_manifest(manifest, old_files, stale)
+            return len(deleted)
+
+    # Loads an index of a segment (json or binary)
+    def __read_segment_index(self, addr:str) -> CompactIndex:
+        if is_binary_index(addr):
+            binary_index = BinaryIndex(addr)
+            try:
+                index = CompactIndex()
+                for term in binary_index:
+                    index.add_entry(term, binary_index[term])
+                return index
+            finally:
+                binary_index.close()
+        with open(addr, 'r', encoding='utf-8') as file:
+            return CompactIndex.load_json(file)
+
+    # Appends live docs of a segment to merged index, refined db and document store
+    # docs of segments without document store (old refined dbs) are taken from their refined db
+    def __merge_segment(self, index:CompactIndex, refined_db:dict, doc_store:DocStoreWriter, segment_index:CompactIndex, segment_db:dict, segment_db_addr:str, tombstones:bytearray):
+        segment_store = DocStore(docs_addr(segment_db_addr)) if is_doc_store(docs_addr(segment_db_addr)) else None
+        for id in segment_db:
+            if not is_deleted(tombstones, int(id)):
+                refined_db[id] = {'t_count': segment_db[id]['t_count']}
+                if segment_store is not None:
+                    doc_store.add_blob(id, segment_store.blob(id))
+                else:
+                    doc_store.add(id, segment_db[id])
+        if segment_store is not None:
+            segment_store.close()
+        for term, entry in segment_index.terms.items():
+            for i in range(len(entry.doc_ids)):
+                if not is_deleted(tombstones, entry.doc_ids[i]):
+                    index.add_posting(term, entry.doc_ids[i], entry.tfs[i], segment_index.posting_positions(entry, i))
+
+    # Compacts base index and its delta segments into a new base index without deleted docs
+    # statistics and champions lists are rebuilt; with background=True it runs in a thread which is returned
+    def merge_segments(self, background:bool=False):
+        if background:
+            thread = threading.Thread(target=self.merge_segments, daemon=True)
+            thread.start()
+            return thread
+        t = clock(self.metrics)
+        with self.segments_lock:
+            manifest = self.__load_manifest()
+            if manifest is None:
+                return None
+            tombstones = self.__load_all_tombstones(manifest)
+            if len(manifest['segments']) == 0 and not any(tombstones['base']):
+                return None
+            # merged base is written under a new generation name, old base stays readable until manifest is saved
+            base = self.__generation_name(manifest, 'base')
+            index = CompactIndex()
+            refined_db = dict()
+            doc_store = DocStoreWriter(docs_addr(segment_addr(self.refined_db_addr, base)))
+            try:
+                with open(base_addr(self.refined_db_addr, manifest), 'r', encoding='utf-8') as file:
+                    base_db = json.load(file)
+                self.__merge_segment(index, refined_db, doc_store, self.__read_segment_index(base_addr(self.save_addr, manifest)),
+                                     base_db, base_addr(self.refined_db_addr, manifest), tombstones['base'])
+                for segment in manifest['segments']:
+                    name = segment['name']
+                    with open(segment_addr(self.refined_db_addr, name), 'r', encoding='utf-8') as file:
+                        segment_db = json.load(file)
+                    self.__merge_segment(index, refined_db, doc_store, self.__read_segment_index(segment_addr(self.save_addr, name)),
+                                         segment_db, segment_addr(self.refined_db_addr, name), tombstones[name])
+            except Exception:
+                doc_store.discard()
+                raise
+            self.index = self.__sort_index(index)
+            self.refined_db = refined_db
+            self.__compute_statistics(self.index, self.refined_db)
+            if self.champions_size > 0:
+                self.__build_champions_list()
+            self.tiers = []
+            if self.tier1_fraction > 0:
+                self.__build_tiers()
+            self.__save_index(segment_addr(self.save_addr, base), segment_addr(self.refined_db_addr, base))
+            doc_store.close()
+            self.__reset_segments(base)
+            if self.DEBUG:
+                print("{} segments merged, docs: {}, terms: {}".format(len(manifest['segments']), len(self.refined_db), len(self.index)))
+        lap(self.metrics, 'indexer.merge', t)
+        return None
+
     # set normalizer
     def set_enable_normalizer(self, enable_normalizer:bool=True):
         self.enable_normalizer = enable_normalizer
+        self.text_processor.enable_normalizer = enable_normalizer
+
+    # set number of indexing processes and number of docs per shard
+    def set_workers(self, workers:int=1, chunk_size:int=500):
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+
+    # set index file format: 'json' or 'binary'
+    def set_index_format(self, index_format:str='json'):
+        self.index_format = index_format
+
+    # set champions lists: r docs per term ordered by 'tf' or 'score', r=0 disables them
+    def set_champions_list(self, champions_size:int, champions_order:str='tf'):
+        self.champions_size = champions_size
+        self.champions_order = champions_order
+
+    # set metrics registry of stage times and counters (None disables metrics)
+    # stages: indexer.load, normalize, tokenize, stem, invert, sort, stop_words, statistics, champions, tiers, save,
+    # add_documents, merge; counters: indexer.docs, tokens, terms
+    # invert is the second pass in this process (workers only process text), normalize/tokenize/stem of workers
+    # are summed from their stats
+    def set_metrics(self, metrics:MetricsRegistry=None):
+        self.metrics = metrics
+
+    # set tiered index: fraction of postings (highest tf*idf) in tier 1, 0 disables tiers
+    def set_tiers(self, tier1_fraction:float=0.2):
+        self.tier1_fraction = max(0.0, min(1.0, tier1_fraction))
+
+    # set number of index shards, 1 saves a single index
+    def set_shards(self, shards:int=1):
+        self.shards = max(1, shards)
+
+    # set streaming mode: docs are read one by one instead of loading whole db
+    def set_streaming(self, streaming:bool=True):
+        self.streaming = streaming
         
     # Run the indexer
     def run(self):
-        self.__load_db()
-        if self.db is None: 
-            return
-        self.__indexer_engine()
-        self.__save_index()
+        self.__open_doc_stores()
+        try:
+            self.__run()
+        finally:
+            self.__discard_doc_stores()
+
+    def __run(self):
+        if self.streaming:
+            try:
+                self.__indexer_engine(self.__stream_db())
+            # File not found
+            except FileNotFoundError:
+                print("file not found in {}".format(self.load_addr))
+                return
+            # Invalid json file
+            except json.JSONDecodeError as e:
+                print("JSON decoding error:", e)
+                return
+        else:
+            t = clock(self.metrics)
+            self.__load_db()
+            lap(self.metrics, 'indexer.load', t)
+            if self.db is None: 
+                return
+            self.__indexer_engine((id, self.db[id]['content']) for id in self.db)
+        t = clock(self.metrics)
+        with self.segments_lock:
+            if self.shards > 1:
+                self.__save_shards()
+            else:
+                self.__save_index(self.save_addr, self.refined_db_addr)
+                self.__reset_segments()
+            self.__close_doc_stores()
+        lap(self.metrics, 'indexer.save', t)
@@ -0,0 +1,75 @@
+import json
+from typing import Any, Iterator, TextIO, Tuple
+
+# Incremental parser for a json file with a top-level object like {"id": {...}, "id": {...}}
+# Only one member of the object is kept in memory at a time.
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = set('0123456789+-.eE')
+
+
+# Reads the file chunk by chunk and yields (key, value) of the top-level object
+def iter_json_object(file:TextIO, buffer_size:int=1 << 16) -> Iterator[Tuple[str, Any]]:
+    buf = ''
+    pos = 0
+    eof = False
+
+    # makes sure buffer has something after pos (skipping white spaces), returns False at end of file
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return True
+            if eof:
+                return False
+            chunk = file.read(buffer_size)
+            buf = buf[pos:] + chunk
+            pos = 0
+            eof = chunk == ''
+
+    # decodes next json value, reading more of the file while the value is incomplete
+    # each retry reads twice as much as the one before, so a large value is parsed O(log(size)) times, not O(size)
+    def next_value() -> Any:
+        nonlocal buf, pos, eof
+        read_size = buffer_size
+        while True:
+            if not fill():
+                raise json.JSONDecodeError('Expecting value', buf, pos)
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+                # a number at the end of buffer may continue in the next chunk
+                if eof or not isinstance(value, (int, float)) or not _NUMBER_CHARS.issuperset(buf[end:]):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            chunk = file.read(read_size)
+            buf = buf[pos:] + chunk
+            pos = 0
+            eof = chunk == ''
+            read_size *= 2
+
+    # expects one of chars as next non-white-space char
+    def expect(chars:str) -> str:
+        nonlocal pos
+        if not fill() or buf[pos] not in chars:
+            raise json.JSONDecodeError('Expecting one of {!r}'.format(chars), buf, pos)
+        pos += 1
+        return buf[pos - 1]
+
+    expect('{')
+    if fill() and buf[pos] == '}':
+        pos += 1
+        return
+    while True:
+        key = next_value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError('Expecting property name', buf, pos)
+        expect(':')
+        yield key, next_value()
+        if expect(',}') == '}':
+            return
@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List
+
+# Bounded least-recently-used cache with optional time to live (seconds)
+class LRUCache:
+
+    def __init__(self, max_size:int=1024, ttl:float=None) -> None:
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.items = OrderedDict()      # key -> (insert time, value)
+        self.hits = 0
+        self.misses = 0
+
+    # Returns cached value of key, default if it is missing or expired
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        if self.ttl is not None and time.monotonic() - item[0] > self.ttl:
+            del self.items[key]
+            self.misses += 1
+            return default
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    # Adds value of key, the least recently used item is dropped when cache is full
+    def put(self, key:Hashable, value:Any):
+        self.items[key] = (time.monotonic(), value)
+        self.items.move_to_end(key)
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    # Changes max size, least recently used items are dropped when cache is larger
+    def resize(self, max_size:int):
+        self.max_size = max(1, max_size)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    # Drops item of key if it is cached
+    def discard(self, key:Hashable):
+        self.items.pop(key, None)
+
+    # cached keys, least recently used first
+    def keys(self) -> List[Hashable]:
+        return list(self.items)
+
+    # Drops all items (counters are kept)
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    # hits, misses, hit rate and size of cache
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0.0,
+            'size': len(self.items),
+        }
@@ -0,0 +1,124 @@
+import time
+from collections import deque
+from typing import Callable, Dict, List
+
+# Metrics of indexer and search engine: counters, histograms (stage seconds, postings per query, ...) and callbacks
+# components keep metrics=None by default, then each stage costs a single None check
+#   metrics = MetricsRegistry()
+#   engine.set_metrics(metrics); indexer.set_metrics(metrics)
+#   metrics.add_callback(lambda name, value: ...)    # called on every observed value
+#   metrics.snapshot()
+
+# Observed values of a metric: count, sum, min, max and percentiles of last max_samples values
+class Histogram:
+
+    def __init__(self, max_samples:int=10000) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value:float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    # p-th percentile (nearest rank) of samples, 0 if there is no sample
+    def percentile(self, p:float) -> float:
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count > 0 else 0.0,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+# Measures seconds of a block into a histogram: with metrics.timer('indexer.sort'): ...
+class _Timer:
+
+    def __init__(self, registry, name:str) -> None:
+        self.registry = registry
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+
+    def __init__(self, max_samples:int=10000) -> None:
+        self.max_samples = max_samples
+        self.counters = dict()          # name -> int
+        self.histograms = dict()        # name -> Histogram
+        self.callbacks = []             # fn(name, value) called on every counter increment and observed value
+
+    def inc(self, name:str, n:int=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        for callback in self.callbacks:
+            callback(name, n)
+
+    def observe(self, name:str, value:float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram(self.max_samples)
+            self.histograms[name] = histogram
+        histogram.observe(value)
+        for callback in self.callbacks:
+            callback(name, value)
+
+    def timer(self, name:str) -> _Timer:
+        return _Timer(self, name)
+
+    def add_callback(self, callback:Callable[[str, float], None]):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback:Callable[[str, float], None]):
+        self.callbacks.remove(callback)
+
+    # counters and histogram stats -> {'counters': {name: int}, 'histograms': {name: stats}}
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            'counters': dict(self.counters),
+            'histograms': {name: self.histograms[name].stats() for name in sorted(self.histograms)},
+        }
+
+    # drops all values (callbacks are kept)
+    def reset(self):
+        self.counters = dict()
+        self.histograms = dict()
+
+    def names(self) -> List[str]:
+        return sorted(set(self.counters) | set(self.histograms))
+
+
+# Stage timing helpers for components with optional metrics (metrics=None: nothing is measured)
+#   t = clock(self.metrics); ...stage...; t = lap(self.metrics, 'indexer.sort', t)
+def clock(metrics:MetricsRegistry):
+    return time.perf_counter() if metrics is not None else None
+
+# observes seconds since start as name and returns current time
+def lap(metrics:MetricsRegistry, name:str, start:float):
+    if metrics is None:
+        return None
+    now = time.perf_counter()
+    metrics.observe(name, now - start)
+    return now
@@ -0,0 +1,269 @@
+import json
+from array import array
+from bisect import bisect_left
+from heapq import nsmallest
+from typing import Dict, Iterable, Iterator, List, Set, TextIO, Tuple
+from json_stream import iter_json_object
+
+# Compact in-memory index
+# postings of a term are parallel arrays of integer doc ids, tfs and offsets into one positions buffer
+# shared by all terms (positions of a posting are position_buffer[offset:offset + tf]), so a posting costs
+# a few machine words instead of a dict with a string key and a list of int objects.
+# Indexer builds it and search engine loads index.json into it; it acts like the dict of index.json
+# (get/[]/in/iteration give entries like index.json) and like BinaryIndex (postings/positions).
+
+
+# Statistics and postings of a term
+class TermEntry:
+    __slots__ = ('freq', 'df', 'idf', 'max_tf', 'max_nw', 'doc_ids', 'tfs', 'pos_offsets')
+
+    def __init__(self, freq:int=0, df:int=0, idf:float=0.0, max_tf:int=0, max_nw:float=0.0) -> None:
+        self.freq = freq
+        self.df = df
+        self.idf = idf
+        self.max_tf = max_tf
+        self.max_nw = max_nw
+        self.doc_ids = array('I')
+        self.tfs = array('I')
+        self.pos_offsets = array('Q')
+
+    # appends a posting whose positions are at offset of positions buffer
+    def append(self, doc_id:int, tf:int, offset:int):
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+        self.pos_offsets.append(offset)
+        self.freq += tf
+        self.df += 1
+        if tf > self.max_tf:
+            self.max_tf = tf
+
+
+class CompactIndex:
+
+    def __init__(self, position_buffer:array=None) -> None:
+        self.terms = dict()                                             # term -> TermEntry
+        self.position_buffer = position_buffer if position_buffer is not None else array('I')  # shared positions buffer
+
+    # ####################### building
+
+    # Appends terms of a doc (positions start from 1), docs should be added in doc id order
+    # stop words are skipped, other terms keep their positions
+    def add_document(self, doc_id:int, terms:List[str], stop_words:Set[str]=frozenset()):
+        doc_positions = dict()
+        position = 0
+        for term in terms:
+            position += 1
+            if term in doc_positions:
+                doc_positions[term].append(position)
+            elif term not in stop_words:
+                doc_positions[term] = [position]
+        for term, positions in doc_positions.items():
+            self.add_posting(term, doc_id, len(positions), positions)
+
+    # Appends a posting of a term with its positions
+    def add_posting(self, term:str, doc_id:int, tf:int, positions:Iterable[int]):
+        entry = self.terms.get(term)
+        if entry is None:
+            entry = TermEntry()
+            self.terms[term] = entry
+        entry.append(doc_id, tf, len(self.position_buffer))
+        self.position_buffer.extend(positions)
+
+    # Sorts terms, and postings of each term by doc id (only terms whose docs were not added in order)
+    def sort(self):
+        self.terms = dict(sorted(self.terms.items()))
+        for entry in self.terms.values():
+            doc_ids = entry.doc_ids
+            if any(doc_ids[i] > doc_ids[i + 1] for i in range(len(doc_ids) - 1)):
+                order = sorted(range(len(doc_ids)), key=doc_ids.__getitem__)
+                entry.doc_ids = array('I', [doc_ids[i] for i in order])
+                entry.tfs = array('I', [entry.tfs[i] for i in order])
+                entry.pos_offsets = array('Q', [entry.pos_offsets[i] for i in order])
+            entry.max_tf = max(entry.tfs, default=0)
+
+    # New index with some postings of each term (terms -> sorted indexes of postings), positions buffer is shared
+    # df and idf stay the ones of this index, freq and max tf are the ones of selected postings
+    def subset(self, selected:Dict[str, List[int]]) -> 'CompactIndex':
+        res = CompactIndex(self.position_buffer)
+        for term, indexes in selected.items():
+            entry = self.terms[term]
+            new_entry = TermEntry(0, 0, entry.idf, 0, 0.0)
+            for i in indexes:
+                new_entry.append(entry.doc_ids[i], entry.tfs[i], entry.pos_offsets[i])
+            new_entry.df = entry.df
+            res.terms[term] = new_entry
+        return res
+
+    def pop(self, term:str) -> TermEntry:
+        return self.terms.pop(term)
+
+    # ####################### reading
+
+    # positions of i-th posting of a term entry
+    def posting_positions(self, entry:TermEntry, i:int) -> array:
+        offset = entry.pos_offsets[i]
+        return self.position_buffer[offset:offset + entry.tfs[i]]
+
+    # Returns (sorted doc ids, tfs, max tf, idf, max normalized weight) of a term
+    def postings(self, term:str) -> Tuple[array, array, int, float, float]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return array('I'), array('I'), 0, 0.0, 0.0
+        return entry.doc_ids, entry.tfs, entry.max_tf, entry.idf, entry.max_nw
+
+    # Returns {doc_id: positions} of given sorted doc ids of a term
+    def positions(self, term:str, doc_ids:List[int]) -> Dict[int, List[int]]:
+        res = dict()
+        entry = self.terms.get(term)
+        if entry is None:
+            return res
+        lo = 0
+        for doc_id in doc_ids:
+            lo = bisect_left(entry.doc_ids, doc_id, lo)
+            if lo == len(entry.doc_ids):
+                break
+            if entry.doc_ids[lo] == doc_id:
+                res[doc_id] = self.posting_positions(entry, lo).tolist()
+        return res
+
+    # Returns entry of a term like index.json: {'freq', 'df', 'idf', 'max_tf', 'max_nw', 'postings_list': {doc_id: {'tf', 'positions'}}}
+    def get(self, term:str, default=None):
+        entry = self.terms.get(term)
+        if entry is None:
+            return default
+        postings_list = dict()
+        for i in range(len(entry.doc_ids)):
+            postings_list[str(entry.doc_ids[i])] = {'tf': entry.tfs[i], 'positions': self.posting_positions(entry, i).tolist()}
+        return {'freq': entry.freq, 'df': entry.df, 'idf': entry.idf, 'max_tf': entry.max_tf, 'max_nw': entry.max_nw, 'postings_list': postings_list}
+
+    def __getitem__(self, term:str) -> dict:
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term:str) -> bool:
+        return term in self.terms
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def keys(self) -> List[str]:
+        return list(self.terms)
+
+    # nothing to release (same interface as BinaryIndex)
+    def close(self):
+        pass
+
+    # bytes of postings arrays and positions buffer
+    def nbytes(self) -> int:
+        size = self.position_buffer.itemsize * len(self.position_buffer)
+        for entry in self.terms.values():
+            size += entry.doc_ids.itemsize * len(entry.doc_ids) + entry.tfs.itemsize * len(entry.tfs) + entry.pos_offsets.itemsize * len(entry.pos_offsets)
+        return size
+
+    # ####################### json
+
+    # Writes index as index.json (same text as json.dump of its dict with indent=2), one term at a time
+    def write_json(self, file:TextIO):
+        if len(self.terms) == 0:
+            file.write('{}')
+            return
+        file.write('{')
+        first = True
+        for term in self.terms:
+            entry = json.dumps(self.get(term), indent=2, ensure_ascii=False).replace('\n', '\n  ')
+            file.write('{}\n  {}: {}'.format('' if first else ',', json.dumps(term, ensure_ascii=False), entry))
+            first = False
+        file.write('\n}')
+
+    # Adds a term entry of index.json
+    def add_entry(self, term:str, entry:dict):
+        postings_list = entry['postings_list']
+        for doc_id in postings_list:
+            self.add_posting(term, int(doc_id), postings_list[doc_id]['tf'], postings_list[doc_id]['positions'])
+        new_entry = self.terms.get(term)
+        if new_entry is None:
+            new_entry = TermEntry()
+            self.terms[term] = new_entry
+        new_entry.freq = entry['freq']
+        new_entry.idf = entry['idf']
+        new_entry.max_nw = entry['max_nw']
+
+    # Loads index.json term by term, None if its entries do not have statistics (old index files)
+    @staticmethod
+    def load_json(file:TextIO):
+        index = CompactIndex()
+        for term, entry in iter_json_object(file):
+            if 'idf' not in entry or 'max_nw' not in entry:
+                return None
+            index.add_entry(term, entry)
+        return index
+
+
+# Terms of processed docs as ids of a vocabulary, with collection frequency of each term
+# it is the first pass of indexing: stop words are chosen from frequencies before any postings are built
+class TermStream:
+
+    def __init__(self) -> None:
+        self.vocabulary = dict()        # term -> id
+        self.terms = []                 # id -> term
+        self.freqs = array('Q')         # id -> number of occurrences
+        self.doc_ids = []               # docs in order they are added
+        self.doc_ends = array('Q')      # end of terms of each doc in term_ids
+        self.term_ids = array('I')
+
+    def add_document(self, doc_id:str, terms:List[str]):
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = len(self.terms)
+                self.vocabulary[term] = term_id
+                self.terms.append(term)
+                self.freqs.append(0)
+            self.freqs[term_id] += 1
+            self.term_ids.append(term_id)
+        self.doc_ids.append(doc_id)
+        self.doc_ends.append(len(self.term_ids))
+
+    # Appends docs of another stream (e.g. of a worker process), its ids are mapped to ids of this stream
+    def merge(self, other:'TermStream'):
+        mapping = array('I')
+        for term, freq in zip(other.terms, other.freqs):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = len(self.terms)
+                self.vocabulary[term] = term_id
+                self.terms.append(term)
+                self.freqs.append(0)
+            self.freqs[term_id] += freq
+            mapping.append(term_id)
+        base = len(self.term_ids)
+        self.term_ids.extend(mapping[term_id] for term_id in other.term_ids)
+        self.doc_ids.extend(other.doc_ids)
+        self.doc_ends.extend(end + base for end in other.doc_ends)
+
+    # n most frequent terms (equal frequencies keep smaller terms), most frequent first
+    def most_frequent(self, n:int) -> List[Tuple[str, int]]:
+        top = nsmallest(n, range(len(self.terms)), key=lambda i: (-self.freqs[i], self.terms[i]))
+        return [(self.terms[i], self.freqs[i]) for i in top]
+
+    # Builds postings of all docs without stop words (they keep their positions)
+    def invert(self, index:CompactIndex, stop_words:Set[str]=frozenset()):
+        start = 0
+        for doc_id, end in zip(self.doc_ids, self.doc_ends):
+            index.add_document(int(doc_id), [self.terms[term_id] for term_id in self.term_ids[start:end]], stop_words)
+            start = end
+
+
+# Loads an index.json as CompactIndex, old index files (without statistics) are loaded as dict
+def load_json_index(addr:str):
+    with open(addr, 'r', encoding='utf-8') as file:
+        index = CompactIndex.load_json(file)
+    if index is not None:
+        return index
+    with open(addr, 'r', encoding='utf-8') as file:
+        return json.load(file)
@@ -1,7 +1,87 @@
-import json, math, time
-from typing import List
-from hazm import Normalizer, Lemmatizer, word_tokenize
-from heapq import heappop, heappush, heapify
+import json, math, re, time
+from array import array
+from bisect import bisect_left
+from multiprocessing import get_all_start_methods, get_context
+from typing import Dict, Iterator, List, Tuple
+from heapq import heapify, heappop, heappush, heapreplace, merge, nlargest
+from binary_index import BinaryIndex, is_binary_index
+from doc_store import DocStore, is_doc_store
+from index_files import champions_addr, docs_addr, segments_addr, segment_addr, stats_addr, tier1_addr, tiers_addr
+from lru_cache import LRUCache
+from metrics import MetricsRegistry, clock, lap
+from postings import load_json_index
+from segments import SegmentedIndex, base_addr, load_manifest, load_segment_tombstones, is_deleted, read_positions
+from text_processor import TextProcessor
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# snippets are chosen among windows of this many positions, by number of distinct query terms in them
+SNIPPET_WINDOW = 20
+
+# log10(1 + tf) of small tfs
+TF_WEIGHTS = [math.log10(1 + tf) for tf in range(256)]
+
+# tf weight of a posting
+def tf_weight(tf:int) -> float:
+    if tf < 256:
+        return TF_WEIGHTS[tf]
+    return math.log10(1 + tf)
+
+# first index i >= lo of a sorted list with seq[i] >= target
+# galloping: steps of 1, 2, 4, ... from lo and binary search in the last step, fast when target is near lo
+def gallop_left(seq, target:int, lo:int=0) -> int:
+    n = len(seq)
+    hi = lo
+    step = 1
+    while hi < n and seq[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(seq, target, lo, min(hi, n))
+
+# start positions of a phrase in a doc
+# lists: [(offset of term in phrase, sorted positions of term in doc)], merged from the shortest list
+def phrase_starts(lists:List[Tuple[int, List[int]]]) -> List[int]:
+    lists = sorted(lists, key=lambda x: len(x[1]))
+    offset, positions = lists[0]
+    starts = [p - offset for p in positions]
+    for offset, positions in lists[1:]:
+        new_starts = []
+        lo = 0
+        for start in starts:
+            lo = gallop_left(positions, start + offset, lo)
+            if lo == len(positions):
+                break
+            if positions[lo] == start + offset:
+                new_starts.append(start)
+        starts = new_starts
+        if len(starts) == 0:
+            break
+    return starts
+
+# length of the smallest window of a doc holding one position of each list
+def min_span(lists:List[List[int]]) -> int:
+    heap = [(positions[0], i, 0) for i, positions in enumerate(lists)]
+    heapify(heap)
+    last = max(positions[0] for positions in lists)
+    span = last - heap[0][0] + 1
+    while True:
+        first, i, j = heappop(heap)
+        span = min(span, last - first + 1)
+        if j + 1 == len(lists[i]):
+            return span
+        heappush(heap, (lists[i][j + 1], i, j + 1))
+        last = max(last, lists[i][j + 1])
+
+# Engine of batch worker processes (inherited by fork)
+_batch_engine = None
+
+# ranks a chunk of a batch (queries, k) -> [[(doc_id, score)]]
+def _batch_rank(args:Tuple[List[str], int]) -> List[List[Tuple[str, float]]]:
+    queries, k = args
+    return _batch_engine.rank_batch(queries, k)
 
 class SearchEngine:
 
@@ -11,30 +91,73 @@ class SearchEngine:
         self.refined_db_addr = refined_db_addr
         self.index_is_loaded = False
         self.index = dict()
-        self.db = dict()
+        self.db = dict()                     # refined db: statistics of docs (old refined dbs also have title, content and url)
+        self.doc_stores = []                 # document stores of base index and delta segments, docs are read on demand
+        self.snippet_size = 150              # chars of snippets
         self.DEBUG = debug_mode
         self.max_doc = 1000
         self.enable_normalizer = enable_normalizer
         self.using_champions_allowed = False # it is not allowed by default
-        self.champions_list = dict()         # TODO: it goes from a token to a few number of docs
+        self.champions_list = dict()         # it goes from a token to a few number of docs
+        self.champions_lists = dict()        # x_most_related (None: saved by indexer) -> champions list
+        self.champions_key = None            # x_most_related of current champions list
         self.search_score_mode = 'tf_idf'
+        self.query_mode = 'or'               # 'or': docs with any query term, 'and': docs with all query terms, 'phrase': docs with query as phrase
+        self.proximity_boost = 0.0           # score *= 1 + proximity_boost * closeness of query terms in doc (0: disabled)
+        self.dynamic_pruning = True          # WAND top k instead of scoring all candidates
+        self.pruning_epsilon = 1e-9          # slack of upper bounds against float rounding
+        self.tiered_search = True            # searches tier 1 first when indexer saved a tiered index
+        self.tier1 = None                    # tier 1 of tiered index (high tf*idf postings), None: no tiers
+        self.tier2_bounds = None             # term -> (max tf, max normalized weight) of postings out of tier 1
+        self.postings_cache_size = 4096      # terms kept in each postings cache (decoded postings of recent terms)
+        self.tier_postings_cache = LRUCache(self.postings_cache_size)  # term -> doc ids of term in tier 1
+        self.postings_cache = LRUCache(self.postings_cache_size)       # (champions?, term) -> (doc ids, tfs, max tf, idf, max normalized weight)
+        self.doc_norms = None                # doc_id -> L2 norm of doc vector (for cosine)
+        self.max_doc_id = 0
+        self.scoring_backend = 'python'      # 'python' or 'numpy' (vectorized scoring)
+        self.np_postings_cache = LRUCache(self.postings_cache_size)    # (champions?, term) -> (doc ids, tf weights) numpy arrays
+        self.np_doc_norms = None             # dense numpy vector of doc norms
         self.max_display_res = 5
+        self.manifest = None                 # manifest of segments read by run(), it names the files of index (None: no updates)
+        self.segments = None                 # (base tombstones, [(delta index, tombstones)]) of incremental updates
+        self.global_idf = None               # term -> idf of whole index when this engine searches one shard
+        self.stop_words = None               # stop words removed by indexer (None: unknown, old index files)
+        self.corpus_stats = None             # corpus statistics saved by indexer (docs, tokens, vocabulary size, df histogram)
+        self.metrics = None                  # MetricsRegistry of stage times and postings per query (None: disabled)
+        self.query_cache = LRUCache(1024)    # query -> processed query tokens (None: disabled)
+        self.result_cache = LRUCache(1024)   # (tokens, modes, champions, k) -> ranked results (None: disabled)
         # tools configs
-        self.normalizer = Normalizer().normalize
-        self.stemmer = Lemmatizer().lemmatize
-        self.tokenizer = word_tokenize
-        self.useless_notations = ['_' ,'-', '+', '*', '%', '$', '/', '.', '!', '(', ')', '^', '=', '<', '>', '?', '&', '@'
-                                   '\\', ';', '\'', '\"', '{', '}', '[', ']', ':', '«', '»', ','] # useless notations
+        self.text_processor = TextProcessor(enable_normalizer)  # same text processing as indexer
 
     # Loads Index File
+    # binary index files are memory-mapped and their terms are decoded on lookup, else json is loaded into compact arrays
     def __load_index(self):
+        if not isinstance(self.index, dict):
+            self.index.close()
+        for champions_list in self.champions_lists.values():
+            if not isinstance(champions_list, dict):
+                champions_list.close()
+        if self.tier1 is not None:
+            self.tier1.close()
+        self.tier1 = None
+        self.tier2_bounds = None
+        self.tier_postings_cache.clear()
+        self.segments = None
+        self.champions_lists = dict()
+        self.champions_list = dict()
+        self.using_champions_allowed = False
+        self.postings_cache.clear()
+        self.np_postings_cache.clear()
+        addr = base_addr(self.index_addr, self.manifest)
         try:
-            with open(self.index_addr, 'r', encoding='utf-8') as file:
-                self.index = json.load(file)
+            if is_binary_index(addr):
+                self.index = BinaryIndex(addr)
                 return True
+            self.index = load_json_index(addr)
+            return True
         # File not found
         except FileNotFoundError:
-            print("file not found in '{}'".format(self.index_addr))
+            print("file not found in '{}'".format(addr))
         # Invalid json file
         except json.JSONDecodeError as e:
             print("JSON decoding error:", e)
@@ -43,20 +166,22 @@ class SearchEngine:
             print("error:", e)
         return False
     
-        # Loads Index File
-    
-    # Loads Refined DB
+    # Loads Refined DB and opens its document store (titles, urls and contents are not loaded)
     def __load_refined_db(self):
+        for doc_store in self.doc_stores:
+            doc_store.close()
+        self.doc_stores = []
+        addr = base_addr(self.refined_db_addr, self.manifest)
         try:
-            with open(self.refined_db_addr, 'r', encoding='utf-8') as file:
+            with open(addr, 'r', encoding='utf-8') as file:
                 self.db = json.load(file)
-                self.max_doc = len(list(self.db.keys()))
-                if self.DEBUG:
-                    print("Max Doc:{}".format(self.max_doc))
-                return True
+            if is_doc_store(docs_addr(addr)):
+                self.doc_stores.append(DocStore(docs_addr(addr)))
+            self.__set_db_statistics()
+            return True
         # File not found
         except FileNotFoundError:
-            print("file not found in '{}'".format(self.refined_db_addr))
+            print("file not found in '{}'".format(addr))
         # Invalid json file
         except json.JSONDecodeError as e:
             print("JSON decoding error:", e)
@@ -65,198 +190,720 @@ class SearchEngine:
             print("error:", e)
         return False
 
+    # Sets number of docs, max doc id and doc norms of loaded db
+    def __set_db_statistics(self):
+        self.max_doc = len(list(self.db.keys()))
+        self.doc_norms = None
+        self.max_doc_id = max((int(doc_id) for doc_id in self.db), default=0)
+        self.np_doc_norms = None
+        if all('norm' in doc for doc in self.db.values()):
+            self.doc_norms = {int(doc_id): self.db[doc_id]['norm'] for doc_id in self.db}
+        if self.DEBUG:
+            print("Max Doc:{}".format(self.max_doc))
+
+    # Loads delta segments and tombstones of incremental updates (see Indexer.add_documents)
+    # index becomes a view over base index and deltas without deleted docs, refined db gets live docs of deltas
+    def __load_segments(self):
+        manifest = self.manifest
+        if manifest is None:
+            return True
+        base_tombstones = load_segment_tombstones(self.index_addr, manifest, 'base')
+        if len(manifest['segments']) == 0 and not any(base_tombstones):
+            return True
+        try:
+            self.db = {doc_id: self.db[doc_id] for doc_id in self.db if not is_deleted(base_tombstones, int(doc_id))}
+            deltas = []
+            for segment in manifest['segments']:
+                addr = segment_addr(self.index_addr, segment['name'])
+                if is_binary_index(addr):
+                    delta = BinaryIndex(addr)
+                else:
+                    delta = load_json_index(addr)
+                tombstones = load_segment_tombstones(self.index_addr, manifest, segment['name'])
+                deltas.append((delta, tombstones))
+                with open(segment_addr(self.refined_db_addr, segment['name']), 'r', encoding='utf-8') as file:
+                    delta_db = json.load(file)
+                if is_doc_store(docs_addr(segment_addr(self.refined_db_addr, segment['name']))):
+                    self.doc_stores.append(DocStore(docs_addr(segment_addr(self.refined_db_addr, segment['name']))))
+                for doc_id in delta_db:
+                    if not is_deleted(tombstones, int(doc_id)):
+                        self.db[doc_id] = delta_db[doc_id]
+        # File not found
+        except FileNotFoundError as e:
+            print("file not found in '{}'".format(e.filename))
+            return False
+        # Invalid json file
+        except json.JSONDecodeError as e:
+            print("JSON decoding error:", e)
+            return False
+        self.__set_db_statistics()
+        self.segments = (base_tombstones, deltas)
+        self.index = SegmentedIndex([(self.index, base_tombstones)] + deltas, self.max_doc, self.postings_cache_size)
+        if self.DEBUG:
+            print("{} delta segments loaded".format(len(deltas)))
+        return True
+
+    # Loads stop words and corpus statistics saved by indexer (old index files do not have them)
+    def __load_stats(self):
+        self.stop_words = None
+        self.corpus_stats = load_manifest(stats_addr(base_addr(self.index_addr, self.manifest)))
+        if self.corpus_stats is not None:
+            self.stop_words = set(self.corpus_stats['stop_words'])
+
+    # Loads tier 1 and bounds of tier 2 saved by indexer (only tiered indexes have them)
+    # with delta segments, all docs of deltas are in tier 1 (deltas are small)
+    def __load_tiers(self):
+        manifest = load_manifest(tiers_addr(base_addr(self.index_addr, self.manifest)))
+        if manifest is None:
+            return True
+        addr = tier1_addr(base_addr(self.index_addr, self.manifest))
+        try:
+            if is_binary_index(addr):
+                tier1 = BinaryIndex(addr)
+            else:
+                tier1 = load_json_index(addr)
+        # File not found
+        except FileNotFoundError:
+            print("file not found in '{}'".format(addr))
+            return False
+        # Invalid json file
+        except json.JSONDecodeError as e:
+            print("JSON decoding error:", e)
+            return False
+        if self.segments is not None:
+            base_tombstones, deltas = self.segments
+            tier1 = SegmentedIndex([(tier1, base_tombstones)] + deltas, self.max_doc, self.postings_cache_size)
+        self.tier1 = tier1
+        self.tier2_bounds = {term: tuple(bounds) for term, bounds in manifest['tier2_bounds'].items()}
+        return True
+
     # Pre process queries
     def __query_processor(self, q:str) -> List[str]:
-        nq = self.normalizer(q) if self.enable_normalizer else q
-        rmun_nq = ''
-        for i in nq:
-            if i in self.useless_notations:
-                rmun_nq = rmun_nq + ' '
-            else:
-                rmun_nq = rmun_nq + i
-        tokens = self.tokenizer(rmun_nq)
-        stemmed_tokens = []
-        for i in range(len(tokens)):
-            stem = self.stemmer(tokens[i])
-            if len(stem) == 0:
-                continue
-            stemmed_tokens.append(stem)
+        stemmed_tokens = self.text_processor.process(q)
         if self.DEBUG:
             print("purified query tokens: ", stemmed_tokens)
         return stemmed_tokens
 
+    # Quoted parts of a query ("...") are phrases -> terms of each phrase
+    def __phrase_processor(self, q:str) -> List[List[str]]:
+        phrases = []
+        for phrase in re.findall(r'"([^"]+)"', q):
+            terms = self.text_processor.process(phrase)
+            if len(terms) > 0:
+                phrases.append(terms)
+        if self.DEBUG and len(phrases) > 0:
+            print("query phrases: ", phrases)
+        return phrases
+
     # Displays result of search
-    def __display_results(self, res:List[str]):
+    def __display_results(self, res:List[Tuple[str, float]], query:str):
         print("Search Results:")
         if len(res) == 0:
             print("no result found!")
             return
         count = 0
-        for doc_id in res:
-            if count >= self.max_display_res:
-                return
+        for doc in self.documents([doc_id for doc_id, _ in res[:self.max_display_res]], query):
             count += 1
-            title = self.db[doc_id]['title']
-            content = self.db[doc_id]['content']
-            if len(content) > 100:
-                content = content[:100] + '...'
-            url = self.db[doc_id]['url']
-            print('{} - Title: {}'.format(count, title))
-            print(content.replace('\n', ' '))
-            print(url.replace('\n', ' '))
-
-    # use this for merging to list and remaining the orders
-    def __merge_postings(self, list1:List[str], list2:List[str]):
+            print('{} - Title: {}'.format(count, doc['title']))
+            print(doc['snippet'].replace('\n', ' '))
+            print(doc['url'].replace('\n', ' '))
+
+    # Returns {'title', 'content', 'url'} of a live doc
+    # newer segments are searched first (an updated doc is in its delta and in older stores)
+    def get_document(self, doc_id:str) -> dict:
+        for doc_store in reversed(self.doc_stores):
+            doc = doc_store.get(doc_id)
+            if doc is not None:
+                return doc
+        doc = self.db[doc_id]
+        return {'title': doc['title'], 'content': doc['content'], 'url': doc['url']}
+
+    # Returns {'title', 'url', 'snippet'} of result docs, snippets are about query
+    def documents(self, doc_ids:List[str], query:str='') -> List[dict]:
+        terms = set(self.text_processor.process(query)) if query != '' else set()
+        res = []
+        for doc_id in doc_ids:
+            doc = self.get_document(doc_id)
+            res.append({'title': doc['title'], 'url': doc['url'], 'snippet': self.__snippet(doc_id, doc['content'], terms)})
+        return res
+
+    # Query-aware snippet: text around the window of doc with most query terms, found by positions of terms in index
+    # docs without query terms get the beginning of their content
+    def __snippet(self, doc_id:str, content:str, terms:set) -> str:
+        hits = []
+        for term in terms:
+            if term in self.index:
+                hits.extend((position, term) for position in read_positions(self.index, term, [int(doc_id)]).get(int(doc_id), []))
+        start = end = 0
+        text = content
+        if len(hits) > 0:
+            text, spans = self.text_processor.term_spans(content)
+            first, last = self.__snippet_window(sorted(hits))
+            if last <= len(spans):
+                start, end = spans[first - 1][0], spans[last - 1][1]
+        # window is extended to snippet size with text around it, at word boundaries
+        hit_start, hit_end = start, end
+        start = max(0, start - max(0, self.snippet_size - (end - start)) // 2)
+        end = min(len(text), max(end, start + self.snippet_size))
+        space = text.find(' ', start, hit_start)
+        if start > 0 and space >= 0:
+            start = space + 1
+        space = text.rfind(' ', hit_end, end)
+        if end < len(text) and space >= 0:
+            end = space
+        return ('...' if start > 0 else '') + text[start:end].strip() + ('...' if end < len(text) else '')
+
+    # (first, last) positions of the window of SNIPPET_WINDOW positions with most distinct query terms (then most hits)
+    # hits are sorted (position, term)
+    def __snippet_window(self, hits:List[Tuple[int, str]]) -> Tuple[int, int]:
+        best = None
+        counts = dict()
+        lo = 0
+        for hi in range(len(hits)):
+            counts[hits[hi][1]] = counts.get(hits[hi][1], 0) + 1
+            while hits[hi][0] - hits[lo][0] >= SNIPPET_WINDOW:
+                counts[hits[lo][1]] -= 1
+                if counts[hits[lo][1]] == 0:
+                    del counts[hits[lo][1]]
+                lo += 1
+            key = (len(counts), hi - lo + 1)
+            if best is None or key > best[0]:
+                best = (key, hits[lo][0], hits[hi][0])
+        return best[1], best[2]
+
+    # Returns (sorted integer doc ids, tfs, max tf, idf, max normalized weight) of a term in index (cached)
+    def __postings(self, index, term:str) -> Tuple[array, array, int, float, float]:
+        key = (index is self.champions_list, term)
+        postings = self.postings_cache.get(key)
+        if postings is None:
+            postings = self.__read_postings(index, term)
+            self.postings_cache.put(key, postings)
+        return postings
+
+    # Reads (sorted integer doc ids, tfs, max tf, idf, max normalized weight) of a term in index
+    # statistics come from index file when they are stored (they are the base of score upper bounds)
+    def __read_postings(self, index, term:str) -> Tuple[array, array, int, float, float]:
+        if not isinstance(index, dict):
+            return index.postings(term)
+        entry = index[term]
+        postings_list = entry['postings_list']
+        doc_ids = array('I', sorted(int(x) for x in postings_list))
+        tfs = array('I', [postings_list[str(x)]['tf'] for x in doc_ids])
+        max_tf = entry.get('max_tf')
+        if max_tf is None:
+            max_tf = max(tfs, default=0)
+        idf = entry.get('idf')
+        if idf is None:
+            idf = math.log10(self.max_doc/len(doc_ids))
+        max_nw = entry.get('max_nw')
+        if max_nw is None:
+            doc_norms = self.__get_doc_norms()
+            max_nw = max((tf_weight(tf) / doc_norms[doc_id] for doc_id, tf in zip(doc_ids, tfs)), default=0.0)
+        return doc_ids, tfs, max_tf, idf, max_nw
+
+    # Returns doc norms, they are computed from index if refined db does not have them (old index files)
+    def __get_doc_norms(self) -> Dict[int, float]:
+        if self.doc_norms is None:
+            squares = dict()
+            for term in self.index:
+                for doc_id, tf in zip(*self.__postings_ids_tfs(term)):
+                    squares[doc_id] = squares.get(doc_id, 0.0) + tf_weight(tf) ** 2
+            self.doc_norms = {doc_id: math.sqrt(squares[doc_id]) for doc_id in squares}
+        if np is not None and self.np_doc_norms is None:
+            self.np_doc_norms = np.ones(self.max_doc_id + 1, dtype=np.float64)
+            for doc_id in self.doc_norms:
+                if self.doc_norms[doc_id] > 0:
+                    self.np_doc_norms[doc_id] = self.doc_norms[doc_id]
+        return self.doc_norms
+
+    # Returns doc ids and tfs of a term in main index without touching cache
+    def __postings_ids_tfs(self, term:str) -> Tuple[array, array]:
+        if not isinstance(self.index, dict):
+            return self.index.postings(term)[:2]
+        postings_list = self.index[term]['postings_list']
+        return [int(x) for x in postings_list], [postings_list[x]['tf'] for x in postings_list]
+
+    # k-way union (OR) of sorted doc id lists using a heap
+    def __union_postings(self, lists:List[array]) -> List[int]:
         ans = []
-        if len(list1) != 0: item1 = list1.pop(0)
-        if len(list2) != 0: item2 = list2.pop(0)
-        while len(list1) != 0 and len(list2) != 0:
-            if int(item1) > int(item2):
-                ans.append(item2)
-                item2 = list2.pop(0)
-            elif int(item1) < int(item2):
-                ans.append(item1)
-                item1 = list1.pop(0)
-            else:
-                ans.append(item1)
-                item1 = list1.pop(0)
-                item2 = list2.pop(0)
-        if len(list1) != 0:
-            ans.extend(list1)
-        elif len(list2) != 0:
-            ans.extend(list2)
+        last = -1
+        for doc_id in merge(*lists):
+            if doc_id != last:
+                ans.append(doc_id)
+                last = doc_id
         return ans
-    
-    # scoring docs for a term
-    def __score_tf_idf(self, term: str, doc_id: str) -> float:
-        if self.index.get(term) == None:
-            # if self.DEBUG: print("No such term '{}' in index.".format(term))
-            return 0 # no such term exists in our index file
-        if self.index[term]['postings_list'].get(doc_id) == None:
-            # if self.DEBUG: print("No such index={} for term: {}".format(doc_id, term))
-            return 0 # there is no such term in this doc
+
+    # intersection (AND) of sorted doc id lists
+    # starts from the shortest list and looks up its docs in others by galloping search
+    def __intersect_postings(self, lists:List[array]) -> List[int]:
+        if len(lists) == 0:
+            return []
+        lists = sorted(lists, key=len)
+        ans = list(lists[0])
+        for other in lists[1:]:
+            new_ans = []
+            lo = 0
+            for doc_id in ans:
+                lo = gallop_left(other, doc_id, lo)
+                if lo == len(other):
+                    break
+                if other[lo] == doc_id:
+                    new_ans.append(doc_id)
+            ans = new_ans
+            if len(ans) == 0:
+                break
+        return ans
+
+    # query term weights -> [(term, weight)] in query order, weight = count of term in query * idf
+    # idf always comes from the main index
+    def __query_weights(self, processed_q:List[str]) -> List[Tuple[str, float]]:
+        weights = []
+        for term in dict.fromkeys(processed_q):
+            if term in self.index:
+                weights.append((term, processed_q.count(term) * self.__postings(self.index, term)[3]))
+        return weights
+
+    # query norm (for cosine): length of query weights vector
+    # a shard misses terms of other shards, so its query norm comes from global idf
+    def __query_len(self, processed_q:List[str], weights:List[Tuple[str, float]]) -> float:
+        if self.global_idf is None:
+            return math.sqrt(sum(w * w for _, w in weights))
+        return math.sqrt(sum((processed_q.count(term) * self.global_idf[term]) ** 2 for term in dict.fromkeys(processed_q) if term in self.global_idf))
+
+    # final score of a doc from its accumulated tf*idf
+    # cosine divides it by doc norm (over all terms of doc) and query norm
+    def __final_score(self, acc:float, doc_id:int, score_mode:str, q_len:float) -> float:
+        if score_mode == 'cosine':
+            if q_len == 0:
+                return 0.0
+            return acc / (self.doc_norms[doc_id] * q_len)
+        return acc
+
+    # upper bound of a term's contribution to score of a doc, from max tf (tf_idf) or max normalized weight (cosine)
+    def __upper_bound(self, w:float, max_tf:int, max_nw:float, score_mode:str, q_len:float) -> float:
+        if score_mode == 'cosine':
+            return w * max_nw / q_len if q_len > 0 else 0.0
+        return w * tf_weight(max_tf)
+
+    # document-at-a-time WAND top-k
+    # a doc is scored only if sum of upper bounds of its terms can beat the k-th best score,
+    # result is exactly the same as scoring every candidate
+    def __wand_top_k(self, weights:List[Tuple[str, float]], score_mode:str, q_len:float, k:int) -> List[Tuple[float, int]]:
+        # cursor: [doc ids, tfs, position, upper bound, term]
+        cursors = []
+        for term, w in weights:
+            doc_ids, tfs, max_tf, idf, max_nw = self.__postings(self.index, term)
+            cursors.append([doc_ids, tfs, 0, self.__upper_bound(w, max_tf, max_nw, score_mode, q_len), term])
+        heap, scored = self.__wand(cursors, weights, score_mode, q_len, k, [], ())
+        if self.metrics is not None:
+            self.metrics.observe('search.docs_scored', scored)
+        return [(score, -neg_doc_id) for score, neg_doc_id in heap]
+
+    # WAND loop over cursors of main index postings -> (heap of top k as (score, -doc_id), number of scored docs)
+    # heap may start with docs scored before (its k-th score is the first threshold), docs in skip are not scored
+    def __wand(self, cursors:list, weights:List[Tuple[str, float]], score_mode:str, q_len:float, k:int, heap:list, skip) -> Tuple[list, int]:
+        scored = 0
+        while len(cursors) > 0:
+            cursors.sort(key=lambda c: c[0][c[2]])
+            # finding pivot: first cursor where sum of upper bounds may enter top k
+            pivot = None
+            acc = 0.0
+            for i in range(len(cursors)):
+                acc += cursors[i][3]
+                if len(heap) < k or acc + self.pruning_epsilon > heap[0][0]:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot][0][cursors[pivot][2]]
+            if cursors[0][0][cursors[0][2]] == pivot_doc:
+                # all cursors before pivot are on pivot doc -> full evaluation
+                doc_tfs = dict()
+                for c in cursors:
+                    if c[0][c[2]] != pivot_doc:
+                        break
+                    doc_tfs[c[4]] = c[1][c[2]]
+                    c[2] += 1
+                cursors = [c for c in cursors if c[2] < len(c[0])]
+                if pivot_doc in skip:
+                    continue
+                acc = 0.0
+                for term, w in weights:
+                    if term in doc_tfs:
+                        acc += w * tf_weight(doc_tfs[term])
+                item = (self.__final_score(acc, pivot_doc, score_mode, q_len), -pivot_doc)
+                scored += 1
+                if len(heap) < k:
+                    heappush(heap, item)
+                elif item > heap[0]:
+                    heapreplace(heap, item)
+            else:
+                # skipping docs that can not enter top k
+                for c in cursors[:pivot]:
+                    c[2] = bisect_left(c[0], pivot_doc, c[2])
+                cursors = [c for c in cursors if c[2] < len(c[0])]
+        return heap, scored
+
+    # tiered top-k: scores docs of tier 1 postings first, a doc out of tier 1 for all query terms can not score
+    # more than the sum of tier 2 upper bounds, so tier 2 is searched only when k-th score does not beat it
+    # tier 2 is searched by WAND on tier 2 bounds, starting from top k of tier 1 (docs of tier 1 are not scored again)
+    # result is exactly the same as scoring every candidate
+    def __tiered_top_k(self, weights:List[Tuple[str, float]], score_mode:str, q_len:float, k:int) -> List[Tuple[float, int]]:
+        lists = []
+        for term, _ in weights:
+            doc_ids = self.tier_postings_cache.get(term)
+            if doc_ids is None:
+                doc_ids = self.tier1.postings(term)[0]
+                self.tier_postings_cache.put(term, doc_ids)
+            lists.append(doc_ids)
+        seen = self.__union_postings(lists)
+        heap = [(score, -doc_id) for score, doc_id in nlargest(k, self.__score_docs(weights, seen, score_mode, q_len), key=lambda x: (x[0], -x[1]))]
+        heapify(heap)
+        scored = len(seen)
+        tiers = 1
+
+        # cursors of terms having postings out of tier 1, a doc out of tier 1 gets its whole score from them
+        cursors = []
+        for term, w in weights:
+            if term in self.tier2_bounds:
+                doc_ids, tfs = self.__postings(self.index, term)[:2]
+                cursors.append([doc_ids, tfs, 0, self.__upper_bound(w, *self.tier2_bounds[term], score_mode, q_len), term])
+        bound = sum(c[3] for c in cursors)
+        if len(cursors) > 0 and (len(heap) < k or heap[0][0] <= bound + self.pruning_epsilon):
+            heap, tier2_scored = self.__wand(cursors, weights, score_mode, q_len, k, heap, set(seen))
+            scored += tier2_scored
+            tiers = 2
+        if self.metrics is not None:
+            self.metrics.observe('search.docs_scored', scored)
+            self.metrics.observe('search.tiers', tiers)
+        return [(score, -neg_doc_id) for score, neg_doc_id in heap]
+
+    # Returns postings of a term as numpy arrays -> (doc ids, tf weights) (cached)
+    # tf weights are the same floats as tf_weight(), so scores are equal to python backend
+    def __np_postings(self, index, term:str):
+        key = (index is self.champions_list, term)
+        postings = self.np_postings_cache.get(key)
+        if postings is None:
+            doc_ids, tfs = self.__postings(index, term)[:2]
+            postings = (np.frombuffer(doc_ids, dtype=np.uint32), np.fromiter((tf_weight(tf) for tf in tfs), dtype=np.float64, count=len(tfs)))
+            self.np_postings_cache.put(key, postings)
+        return postings
+
+    # numpy top-k: accumulates scores of all docs in a dense vector and selects top k with partition
+    # returns (top k as (score, doc_id), candidate doc ids)
+    def __numpy_top_k(self, index, processed_q:List[str], weights:List[Tuple[str, float]], score_mode:str, q_len:float, k:int):
+        size = self.max_doc_id + 1
+        # candidates: docs of searched index (or: any term, and: all terms)
+        hits = np.zeros(size, dtype=np.int32)
+        query_terms = set(processed_q)
+        for term in query_terms:
+            if term in index:
+                hits[self.__np_postings(index, term)[0]] += 1
+        # a query without terms (e.g. only stop words) has no candidates, not every doc
+        if self.query_mode == 'and' and len(query_terms) > 0:
+            candidates = np.flatnonzero(hits == len(query_terms))
         else:
-            tf = math.log10(1 + self.index[term]['postings_list'][doc_id]['tf'])
-        df = len(list(self.index[term]['postings_list'].keys()))
-        idf = math.log10(self.max_doc/df)
-        # if self.DEBUG: print("for term'{}' and doc:{} tf={}, idf={}".format(term, doc_id, tf, idf))
-        return tf*idf
-
-    # scoring docs by cosine, vector based!
-    # alpha is smoother
-    def __score_cosine(self, vector_q:List[float], vector_q_len: float, vector_d:List[float], alpha:float=0.001)->float:
-        vector_d_len = 0.0
-        for i in vector_d:
-            vector_d_len += math.pow(i, 2)
-        vector_d_len = math.sqrt(vector_d_len)
-        score = 0.0
-        for i in range(len(vector_q)):
-            score += (vector_q[i] * vector_d[i])
-        dv = vector_d_len * vector_q_len + alpha 
-        score /= dv
-        return score
-
-    # search and rank here
-    # alpha is smoother
-    def __search(self, processed_q:List[str], score_mode='tf_idf', alpha:float=0.001) -> List[str]:
+            candidates = np.flatnonzero(hits)
+        if len(candidates) == 0:
+            return [], candidates
+        # scoring on main index: postings of a term have unique doc ids, so fancy-index add is safe
+        scores = np.zeros(size, dtype=np.float64)
+        for term, w in weights:
+            doc_ids, tf_weights = self.__np_postings(self.index, term)
+            scores[doc_ids] += w * tf_weights
+        return self.__np_select_top_k(candidates, scores[candidates], score_mode, q_len, k), candidates
+
+    # top k of candidates from their accumulated scores (numpy arrays) -> [(score, doc_id)]
+    def __np_select_top_k(self, candidates, scores, score_mode:str, q_len:float, k:int) -> List[Tuple[float, int]]:
+        if score_mode == 'cosine':
+            if q_len == 0:
+                scores = np.zeros(len(candidates), dtype=np.float64)
+            else:
+                scores = scores / (self.np_doc_norms[candidates] * q_len)
+        # top k: every doc with score >= k-th score, then sorting by (-score, doc id)
+        if len(candidates) > k:
+            kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+            selected = scores >= kth_score
+            candidates = candidates[selected]
+            scores = scores[selected]
+        order = np.lexsort((candidates, -scores))[:k]
+        return [(float(scores[i]), int(candidates[i])) for i in order]
+
+    # numpy top-k of a batch of queries without phrases -> [[(score, doc_id)]] in order of queries
+    # scores of a block of queries are rows of a matrix: postings of a term are added to every row having it
+    # with one numpy call, and rows add their terms in query order like __numpy_top_k, so scores are the same floats
+    def __numpy_batch_top_k(self, index, batch:List[List[str]], score_mode:str, k:int) -> List[List[Tuple[float, int]]]:
+        size = self.max_doc_id + 1
+        if score_mode == 'cosine':
+            self.__get_doc_norms()
+        queries = []
+        for processed_q in batch:
+            if self.stop_words:
+                processed_q = [term for term in processed_q if term not in self.stop_words]
+            weights = self.__query_weights(processed_q)
+            queries.append((processed_q, weights, self.__query_len(processed_q, weights)))
+        res = []
+        # rows of a block are bounded, so matrices stay small on large indexes
+        block_size = max(1, (1 << 22) // size)
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            hits = np.zeros((len(block), size), dtype=np.int32)
+            rows_of_term = dict()
+            for row, (processed_q, _, _) in enumerate(block):
+                for term in set(processed_q):
+                    if term in index:
+                        rows_of_term.setdefault(term, []).append(row)
+            for term, rows in rows_of_term.items():
+                hits[np.ix_(rows, self.__np_postings(index, term)[0])] += 1
+            # i-th terms of rows are added together, rows having the same i-th term share its postings
+            scores = np.zeros((len(block), size), dtype=np.float64)
+            for i in range(max(len(weights) for _, weights, _ in block)):
+                rows_of_term = dict()
+                for row, (_, weights, _) in enumerate(block):
+                    if i < len(weights):
+                        rows_of_term.setdefault(weights[i][0], []).append(row)
+                for term, rows in rows_of_term.items():
+                    doc_ids, tf_weights = self.__np_postings(self.index, term)
+                    ws = np.array([block[row][1][i][1] for row in rows], dtype=np.float64)
+                    scores[np.ix_(rows, doc_ids)] += np.outer(ws, tf_weights)
+            for row, (processed_q, _, q_len) in enumerate(block):
+                if self.query_mode == 'and' and len(processed_q) > 0:
+                    candidates = np.flatnonzero(hits[row] == len(set(processed_q)))
+                else:
+                    candidates = np.flatnonzero(hits[row])
+                res.append(self.__np_select_top_k(candidates, scores[row][candidates], score_mode, q_len, k) if len(candidates) > 0 else [])
+        return res
+
+    # docs of searched index having any (or) / all (and) of query terms -> sorted doc ids
+    def __candidates(self, index, processed_q:List[str]) -> List[int]:
+        postings = []
+        for term in set(processed_q):
+            if term in index:
+                postings.append(self.__postings(index, term)[0])
+            elif self.query_mode == 'and':
+                return []
+        if self.query_mode == 'and':
+            return self.__intersect_postings(postings)
+        return self.__union_postings(postings)
+
+    # docs of searched index having a phrase -> sorted doc ids
+    # docs having all terms are found first, then positions (of main index) are decoded only for them
+    # stop words (not indexed) match any position; without a stop list every term missing from index does
+    def __phrase_docs(self, index, phrase:List[str]) -> List[int]:
+        terms = [(offset, term) for offset, term in enumerate(phrase) if term in index]
+        if len(terms) == 0:
+            return []
+        if self.stop_words is not None and any(term not in index and term not in self.stop_words for term in phrase):
+            return []
+        docs = self.__intersect_postings([self.__postings(index, term)[0] for _, term in terms])
+        if len(terms) == 1:
+            return docs
+        positions = {term: read_positions(self.index, term, docs) for _, term in terms}
+        return [doc_id for doc_id in docs if len(phrase_starts([(offset, positions[term][doc_id]) for offset, term in terms])) > 0]
+
+    # top k of phrase queries and proximity ranking -> (top k as (score, doc_id), candidate doc ids)
+    # candidates must have all phrases (and all terms in 'and' mode)
+    def __positional_top_k(self, index, processed_q:List[str], phrases:List[List[str]], weights:List[Tuple[str, float]], score_mode:str, q_len:float, k:int):
+        if len(phrases) > 0:
+            related_doc_id = None
+            for phrase in phrases:
+                docs = self.__phrase_docs(index, phrase)
+                related_doc_id = docs if related_doc_id is None else self.__intersect_postings([related_doc_id, docs])
+            if self.query_mode == 'and':
+                related_doc_id = self.__intersect_postings([related_doc_id, self.__candidates(index, processed_q)])
+        else:
+            related_doc_id = self.__candidates(index, processed_q)
+        scored = self.__score_docs(weights, related_doc_id, score_mode, q_len)
+        if self.proximity_boost <= 0:
+            return nlargest(k, scored, key=lambda x: (x[0], -x[1])), related_doc_id
+        return self.__proximity_top_k(list(scored), weights, k), related_doc_id
+
+    # boosts scores of docs where query terms are close: score * (1 + proximity_boost * (m - 1) / (span - 1))
+    # m is number of query terms in doc (at least 2) and span is length of smallest window holding them
+    # boosted score is at most score * (1 + proximity_boost), so docs are boosted by descending score
+    # until that bound can not enter top k; positions are decoded only for those docs
+    def __proximity_top_k(self, scored:List[Tuple[float, int]], weights:List[Tuple[str, float]], k:int) -> List[Tuple[float, int]]:
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        max_boost = 1 + self.proximity_boost
+        heap = []   # min heap of (boosted score, -doc_id) with at most k items
+        chunk_size = max(k, 32)
+        for start in range(0, len(scored), chunk_size):
+            if len(heap) == k and scored[start][0] * max_boost + self.pruning_epsilon < heap[0][0]:
+                break
+            chunk = scored[start:start + chunk_size]
+            docs = sorted(doc_id for _, doc_id in chunk)
+            positions = [read_positions(self.index, term, docs) for term, _ in weights]
+            for score, doc_id in chunk:
+                lists = [doc_positions[doc_id] for doc_positions in positions if doc_id in doc_positions]
+                if len(lists) > 1:
+                    score *= 1 + self.proximity_boost * (len(lists) - 1) / (min_span(lists) - 1)
+                item = (score, -doc_id)
+                if len(heap) < k:
+                    heappush(heap, item)
+                elif item > heap[0]:
+                    heapreplace(heap, item)
+        return [(score, -neg_doc_id) for score, neg_doc_id in heap]
+
+    # search and rank here, returns top k (doc_id, score), k is max display res by default
+    # phrases: terms of quoted parts of query, in 'phrase' query mode the whole query is a phrase
+    def __search(self, processed_q:List[str], score_mode='tf_idf', k:int=None, phrases:List[List[str]]=()) -> List[Tuple[str, float]]:
         
         # set search index (?champions)
         if self.using_champions_allowed:
             index = self.champions_list
         else:
             index = self.index
+        if k is None:
+            k = self.max_display_res
+        if self.query_mode == 'phrase':
+            phrases = [processed_q] if len(processed_q) > 0 else []
+        # stop words are not in index, so they are dropped from query terms (phrases keep them as gaps)
+        if self.stop_words:
+            processed_q = [term for term in processed_q if term not in self.stop_words]
         
         start_time = time.time()
-        
-        # searching only in related docs - index elimination        
-        related_doc_id = []
-        for term in processed_q:
-            if index.get(term) == None:
-                continue
-            related_doc_id = self.__merge_postings(related_doc_id, list(index[term]['postings_list'].keys()))
-        
-        # using max heap to process faster the top k
-        heap = []
-        heapify(heap)
-         
-        # using cosine scoring.
-        if score_mode=='cosine':
-            q_vec = []
-            for term in processed_q:
-                if index.get(term) != None:
-                    idf = math.log(self.max_doc/(1 + len(list(index[term]['postings_list'].keys())))) + alpha
-                else:
-                    idf = alpha
-                q_vec.append(idf)
-            
-            q_vec_len = 0
-            for item in q_vec:
-                q_vec_len += math.pow(item, 2)
-            q_vec_len = math.sqrt(q_vec_len)     
-            
-            for doc_id in related_doc_id:
-                d_vec = []
-                for term in processed_q:
-                    if index.get(term) != None:
-                        if index[term]['postings_list'].get(doc_id) != None:
-                            tf = math.log10(1 + index[term]['postings_list'][doc_id]['tf']) + alpha
-                        else:
-                            tf = alpha
-                    else:
-                        tf = alpha
-                    d_vec.append(tf)
-                score = self.__score_cosine(q_vec, q_vec_len, d_vec, alpha)
-                heappush(heap, (score * -1, doc_id))
-
-        # using tf*idf scoring. DEFAULT
+        t = clock(self.metrics)
+
+        weights = self.__query_weights(processed_q)
+        q_len = self.__query_len(processed_q, weights)
+        if score_mode == 'cosine':
+            self.__get_doc_norms()
+        if self.metrics is not None:
+            self.__observe_postings(index, processed_q, weights)
+            t = time.perf_counter()
+
+        # WAND, numpy and positional top k do candidate generation, scoring and top k together (observed as scoring)
+        # phrases and proximity need positions of candidates
+        if len(phrases) > 0 or self.proximity_boost > 0:
+            top_k, related_doc_id = self.__positional_top_k(index, processed_q, phrases, weights, score_mode, q_len, k)
+            lap(self.metrics, 'search.scoring', t)
+        # vectorized scoring of all candidates
+        elif self.scoring_backend == 'numpy':
+            top_k, related_doc_id = self.__numpy_top_k(index, processed_q, weights, score_mode, q_len, k)
+            lap(self.metrics, 'search.scoring', t)
+        # top k from tier 1, tier 2 only when tier 1 can not guarantee top k (or / main index)
+        elif self.tiered_search and self.tier1 is not None and self.query_mode != 'and' and not self.using_champions_allowed:
+            top_k = self.__tiered_top_k(weights, score_mode, q_len, k)
+            related_doc_id = None   # candidates are not listed, pruned docs are never visited
+            lap(self.metrics, 'search.scoring', t)
+        # top k with dynamic pruning (or / main index)
+        # champions lists are small and their candidates are scored on main index, so they are scored fully
+        elif self.dynamic_pruning and self.query_mode != 'and' and not self.using_champions_allowed:
+            top_k = self.__wand_top_k(weights, score_mode, q_len, k)
+            related_doc_id = None   # candidates are not listed, pruned docs are never visited
+            lap(self.metrics, 'search.scoring', t)
         else:
-            for doc_id in related_doc_id:
-                score = 0.0
-                for term in processed_q:
-                    score = score + self.__score_tf_idf(term, doc_id)
-                heappush(heap, (score * -1, doc_id))
+            # searching only in related docs - index elimination
+            # OR: docs having any of terms, AND: docs having all of terms
+            related_doc_id = self.__candidates(index, processed_q)
+            scored = self.__score_docs(weights, related_doc_id, score_mode, q_len)
+            if self.metrics is not None:
+                t = lap(self.metrics, 'search.candidates', t)
+                self.metrics.observe('search.docs_scored', len(related_doc_id))
+                scored = list(scored)
+                t = lap(self.metrics, 'search.scoring', t)
+            top_k = nlargest(k, scored, key=lambda x: (x[0], -x[1]))
+            lap(self.metrics, 'search.top_k', t)
         
         stop_time = time.time()
         
-        # extracting res
+        # extracting res: higher score first, lower doc id first on equal scores
+        top_k.sort(key=lambda x: (-x[0], x[1]))
         res = []
         count = 0
-        while len(heap) > 0:
-            item = heappop(heap)
+        for score, doc_id in top_k:
             if self.DEBUG and count < 5:
-                print("{}-Doc_ID: {} - Score: {}".format(count, item[1], item[0] * -1))
-            res.append(item[1])
+                print("{}-Doc_ID: {} - Score: {}".format(count, doc_id, score))
+            res.append((str(doc_id), score))
             count += 1
-        if self.DEBUG:
-            print("{} results in {} seconds:".format(len(res), stop_time - start_time))
+        if self.DEBUG and related_doc_id is None:
+            print("top {} (dynamic pruning) in {} seconds:".format(len(res), stop_time - start_time))
+        elif self.DEBUG:
+            print("top {} of {} candidates in {} seconds:".format(len(res), len(related_doc_id), stop_time - start_time))
         return res
 
-    # this function updates champions list, then enables it -> so search engine will use champions list
-    def enable_champions_list(self, x_most_related = 5):
+    # observes number of postings of query terms (searched index and main index for scoring)
+    def __observe_postings(self, index, processed_q:List[str], weights:List[Tuple[str, float]]):
+        touched = sum(len(self.__postings(self.index, term)[0]) for term, _ in weights)
+        if index is not self.index:
+            touched += sum(len(self.__postings(index, term)[0]) for term in set(processed_q) if term in index)
+        self.metrics.observe('search.postings', touched)
+
+    # scores every candidate doc on main index -> (score, doc_id)
+    # each posting costs a single multiply-add, related_doc_id must be sorted
+    def __score_docs(self, weights:List[Tuple[str, float]], related_doc_id:List[int], score_mode:str, q_len:float) -> Iterator[Tuple[float, int]]:
+        postings = [self.__postings(self.index, term)[:2] for term, _ in weights]
+        cursors = [0] * len(weights)
+        for doc_id in related_doc_id:
+            acc = 0.0
+            for i in range(len(weights)):
+                doc_ids, tfs = postings[i]
+                j = bisect_left(doc_ids, doc_id, cursors[i])
+                cursors[i] = j
+                if j < len(doc_ids) and doc_ids[j] == doc_id:
+                    acc += weights[i][1] * tf_weight(tfs[j])
+            yield self.__final_score(acc, doc_id, score_mode, q_len), doc_id
+
+    # Loads champions lists saved next to index by indexer
+    # with delta segments, all docs of deltas are champions (deltas are small)
+    def __load_champions_list(self):
+        addr = champions_addr(base_addr(self.index_addr, self.manifest))
+        try:
+            if is_binary_index(addr):
+                champions_list = BinaryIndex(addr)
+            else:
+                champions_list = load_json_index(addr)
+            if self.segments is not None:
+                base_tombstones, deltas = self.segments
+                champions_list = SegmentedIndex([(champions_list, base_tombstones)] + deltas, self.max_doc, self.postings_cache_size)
+            return champions_list
+        # File not found
+        except FileNotFoundError:
+            print("file not found in '{}'".format(addr))
+        # Invalid json file
+        except json.JSONDecodeError as e:
+            print("JSON decoding error:", e)
+        # Other exceptions
+        except Exception as e:
+            print("error:", e)
+        return None
+
+    # Builds champions lists in memory: x docs with highest tf per term (lower doc id on equal tfs)
+    def __build_champions_list(self, x_most_related:int) -> dict:
+        champions_list = dict()
         for term in self.index:
-            postings = self.index[term]['postings_list']
-            if len(list(postings.keys())) > x_most_related:
-                heap = []
-                heapify(heap)
-                for doc_id in postings:
-                    heappush(heap, (postings[doc_id]['tf'] ,doc_id))
-                extracted_top_docs = list()
-                i = 0
-                while i < x_most_related:
-                    extracted_top_docs.append(int(heappop(heap)[1]))
-                    i += 1
-                # sort in-place
-                extracted_top_docs.sort()
-                new_postings = dict()
-                for doc_id in extracted_top_docs:
-                    new_postings[str(doc_id)] = {'tf':postings[str(doc_id)]['tf'], 'positions': postings[str(doc_id)]['positions']}
-                self.champions_list[term] = {'freq':self.index[term]['freq'],'postings_list':new_postings}    
+            doc_ids, tfs, _, idf, _ = self.__read_postings(self.index, term)
+            top = range(len(doc_ids))
+            if len(doc_ids) > x_most_related:
+                top = sorted(nlargest(x_most_related, top, key=lambda i: (tfs[i], -doc_ids[i])))
+            postings_list = {str(doc_ids[i]): {'tf': tfs[i]} for i in top}
+            champions_list[term] = {'idf': idf, 'max_tf': max(tfs[i] for i in top), 'postings_list': postings_list}
+        return champions_list
+
+    # this function enables champions list -> so search engine will use champions list
+    # by default champions lists saved by indexer are used (loaded once), with x_most_related they are built in memory
+    # loaded/built lists are kept, so switching between them is instant
+    def enable_champions_list(self, x_most_related = None):
+        if x_most_related not in self.champions_lists:
+            if x_most_related is None:
+                champions_list = self.__load_champions_list()
+                if champions_list is None:
+                    print('no saved champions lists, building them with 5 docs per term.')
+                    champions_list = self.champions_lists.get(5) or self.__build_champions_list(5)
             else:
-                self.champions_list[term] = {'freq':self.index[term]['freq'],'postings_list':postings}
+                champions_list = self.__build_champions_list(x_most_related)
+            self.champions_lists[x_most_related] = champions_list
+            if self.DEBUG and isinstance(champions_list, dict):
+                with open('./debug_champions_list.json', 'w', encoding='UTF-8') as file:
+                    json.dump(champions_list, file, indent=2, ensure_ascii=False)
+        if self.champions_list is not self.champions_lists[x_most_related]:
+            self.champions_list = self.champions_lists[x_most_related]
+            self.champions_key = x_most_related
+            for cache in (self.postings_cache, self.np_postings_cache):
+                for key in cache.keys():
+                    if key[0]:
+                        cache.discard(key)
         self.using_champions_allowed = True
-        if self.DEBUG:
-            with open('./debug_champions_list.json', 'w', encoding='UTF-8') as file:
-                json.dump(self.champions_list, file, indent=2, ensure_ascii=False)
  
     # This function prevents search engine from using champions list -> makes it default use of index
     def disable_champions_list(self):
@@ -267,37 +914,227 @@ class SearchEngine:
         self.search_score_mode = mode
         print('search mode set to \'{}\'. if not exist default is tf_idf'.format(mode))
     
+    # set query mode: 'or' (default), 'and' or 'phrase'
+    def set_query_mode(self, mode='or'):
+        self.query_mode = mode if mode in ('and', 'phrase') else 'or'
+        print('query mode set to \'{}\'.'.format(self.query_mode))
+    
+    # set proximity boost: docs where query terms are close get up to (1 + boost) times their score, 0 disables it
+    def set_proximity_boost(self, boost:float=0.0):
+        self.proximity_boost = max(0.0, boost)
+    
+    # set scoring backend: 'python' (default) or 'numpy' (needs numpy)
+    def set_scoring_backend(self, backend='python'):
+        if backend == 'numpy' and np is None:
+            print('numpy is not installed, scoring backend is \'python\'.')
+            backend = 'python'
+        self.scoring_backend = 'numpy' if backend == 'numpy' else 'python'
+    
+    # enables/disables WAND dynamic pruning for top k (results are the same)
+    def set_dynamic_pruning(self, enable:bool=True):
+        self.dynamic_pruning = enable
+    
+    # set number of terms kept in each postings cache (decoded postings of the most recently queried terms)
+    # it bounds memory of long running engines, a binary index is not decoded into memory as a whole
+    def set_postings_cache_size(self, size:int=4096):
+        self.postings_cache_size = max(1, size)
+        for cache in (self.postings_cache, self.np_postings_cache, self.tier_postings_cache):
+            cache.resize(self.postings_cache_size)
+        for index in [self.index, self.tier1] + list(self.champions_lists.values()):
+            if isinstance(index, SegmentedIndex):
+                index.merged.resize(self.postings_cache_size)
+
+    # enables/disables tiered search when index has tiers (results are the same)
+    def set_tiered_search(self, enable:bool=True):
+        self.tiered_search = enable
+
+    # set idf of whole index (term -> idf), used when this engine searches one shard of a sharded index
+    def set_global_idf(self, idf:Dict[str, float]=None):
+        self.global_idf = idf
+        self.clear_cache()
+
+    # set metrics registry (None disables metrics)
+    # stages: search.query_processing, candidates, scoring, top_k, display, batch_scoring (numpy batches of rank_batch);
+    # per query: search.postings, docs_scored, tiers
+    def set_metrics(self, metrics:MetricsRegistry=None):
+        self.metrics = metrics
+
     # set max display res
     def set_max_display_res(self, max_display_res:int):
         if max_display_res <= 0:
             self.max_display_res = 1
         else:
             self.max_display_res = max_display_res
+
+    # set stop words dropped from queries (shards get stop list of whole index)
+    def set_stop_words(self, stop_words:List[str]=None):
+        self.stop_words = set(stop_words) if stop_words is not None else None
+        self.clear_cache()
+
+    # set chars of snippets shown in results
+    def set_snippet_size(self, snippet_size:int=150):
+        self.snippet_size = max(1, snippet_size)
     
     # start search engine
+    # manifest is read first: files of index are the ones it names, even if indexer updates the index meanwhile
     def run(self):
         print("Running search engine...")
+        self.manifest = load_manifest(segments_addr(self.index_addr))
         if not self.__load_index():
             if self.DEBUG:
                 print("Failed to run search engine.")
                 return
         self.__load_refined_db()
+        self.__load_segments()
+        self.__load_tiers()
+        self.__load_stats()
+        self.clear_cache()
         self.index_is_loaded = True
         print("Engine is up.") 
     
+    # processes and searches a query, using query and result caches when they are enabled
+    # results depend on phrases, score mode, query mode, proximity boost, champions list and k, so they are part of the key
+    def __cached_search(self, query:str, score_mode:str, k:int=None) -> List[Tuple[str, float]]:
+        if self.metrics is not None:
+            self.metrics.inc('search.queries')
+        purified_q, phrases = self.__process_query(query)
+        if self.query_cache is None:
+            return self.__search(purified_q, score_mode, k, phrases)
+        if k is None:
+            k = self.max_display_res
+        key = self.__result_key(purified_q, phrases, score_mode, k)
+        res = self.result_cache.get(key)
+        if res is None:
+            res = self.__search(purified_q, score_mode, k, phrases)
+            self.result_cache.put(key, res)
+        elif self.metrics is not None:
+            self.metrics.inc('search.result_cache_hits')
+        return list(res)
+
+    # query -> (query terms, phrases), taken from query cache when it is enabled
+    def __process_query(self, query:str) -> Tuple[List[str], List[List[str]]]:
+        processed = self.query_cache.get(query) if self.query_cache is not None else None
+        if processed is None:
+            t = clock(self.metrics)
+            processed = (self.__query_processor(query), self.__phrase_processor(query))
+            lap(self.metrics, 'search.query_processing', t)
+            if self.query_cache is not None:
+                self.query_cache.put(query, processed)
+        return processed
+
+    # key of ranked results of a processed query in result cache
+    def __result_key(self, purified_q:List[str], phrases:List[List[str]], score_mode:str, k:int) -> tuple:
+        champions_key = self.champions_key if self.using_champions_allowed else False
+        return (tuple(purified_q), tuple(map(tuple, phrases)), score_mode, self.query_mode, self.proximity_boost, champions_key, k)
+
+    # enables LRU caches of processed queries and ranked results, ttl is in seconds (None: no expiry)
+    def enable_cache(self, max_size:int=1024, ttl:float=None):
+        self.query_cache = LRUCache(max_size, ttl)
+        self.result_cache = LRUCache(max_size, ttl)
+
+    # disables query and result caches
+    def disable_cache(self):
+        self.query_cache = None
+        self.result_cache = None
+
+    # drops cached queries and results (counters are kept)
+    def clear_cache(self):
+        if self.query_cache is not None:
+            self.query_cache.clear()
+            self.result_cache.clear()
+
+    # hit/miss counters of query and result caches
+    def cache_stats(self) -> Dict[str, Dict[str, float]]:
+        if self.query_cache is None:
+            return dict()
+        return {'query': self.query_cache.stats(), 'result': self.result_cache.stats()}
+
+    # returns ranked (doc_id, score) of a query instead of displaying them
+    # k <= 0 gives no results
+    def rank(self, query:str, k:int=None) -> List[Tuple[str, float]]:
+        if k is not None and k <= 0:
+            return []
+        return self.__cached_search(query, self.search_score_mode, k)
+
+    # runs many queries and returns ranked (doc_id, score) lists in the same order of queries
+    # with workers > 1 queries run in a process pool; forked workers share loaded index (copy-on-write)
+    def search_batch(self, queries:List[str], k:int=None, workers:int=1) -> List[List[Tuple[str, float]]]:
+        if not self.index_is_loaded:
+            print('Please run() engine first!')
+            return []
+        if k is not None and k <= 0:
+            return [[] for _ in queries]
+        if workers <= 1 or len(queries) <= 1 or 'fork' not in get_all_start_methods():
+            return self.rank_batch(queries, k)
+        global _batch_engine
+        _batch_engine = self
+        try:
+            with get_context('fork').Pool(workers) as pool:
+                chunk_size = -(-len(queries) // (4 * workers))
+                chunks = [(queries[i:i + chunk_size], k) for i in range(0, len(queries), chunk_size)]
+                return [res for chunk in pool.map(_batch_rank, chunks) for res in chunk]
+        finally:
+            _batch_engine = None
+
+    # ranks a batch of queries -> ranked (doc_id, score) lists in order of queries (k <= 0 gives no results)
+    # results are the same as rank() of each query: repeated queries are ranked once, and with numpy backend
+    # queries without phrases or proximity are scored together (postings of a shared term are added once per batch)
+    def rank_batch(self, queries:List[str], k:int=None) -> List[List[Tuple[str, float]]]:
+        if k is None:
+            k = self.max_display_res
+        if k <= 0:
+            return [[] for _ in queries]
+        score_mode = self.search_score_mode
+        keys = []
+        results = dict()    # result key -> ranked results
+        pending = dict()    # result key -> (query terms, phrases) of queries to rank
+        for query in queries:
+            if self.metrics is not None:
+                self.metrics.inc('search.queries')
+            purified_q, phrases = self.__process_query(query)
+            key = self.__result_key(purified_q, phrases, score_mode, k)
+            keys.append(key)
+            if key in results or key in pending:
+                continue
+            res = self.result_cache.get(key) if self.result_cache is not None else None
+            if res is None:
+                pending[key] = (purified_q, phrases)
+                continue
+            results[key] = res
+            if self.metrics is not None:
+                self.metrics.inc('search.result_cache_hits')
+        if self.scoring_backend == 'numpy' and self.query_mode != 'phrase' and self.proximity_boost <= 0:
+            batch = [key for key in pending if len(pending[key][1]) == 0]
+            if len(batch) > 0:
+                index = self.champions_list if self.using_champions_allowed else self.index
+                t = clock(self.metrics)
+                top_ks = self.__numpy_batch_top_k(index, [pending[key][0] for key in batch], score_mode, k)
+                lap(self.metrics, 'search.batch_scoring', t)
+                for key, top_k in zip(batch, top_ks):
+                    top_k.sort(key=lambda x: (-x[0], x[1]))
+                    results[key] = [(str(doc_id), score) for score, doc_id in top_k]
+        for key in pending:
+            if key not in results:
+                results[key] = self.__search(pending[key][0], score_mode, k, pending[key][1])
+            if self.result_cache is not None:
+                self.result_cache.put(key, results[key])
+        return [list(results[key]) for key in keys]
+
     # use this function to search
     def search(self, query=''):
         if not self.index_is_loaded:
             print('Please run() engine first!')
             return
         if query != '':
-            purified_q = self.__query_processor(query)
-            res = self.__search(purified_q, self.search_score_mode)
-            self.__display_results(res)
+            res = self.__cached_search(query, self.search_score_mode)
+            t = clock(self.metrics)
+            self.__display_results(res, query)
+            lap(self.metrics, 'search.display', t)
         else:
             q = ''
             while q.lower() != 'exit':
                 q = input('Please Type Your Query: ')
-                purified_q = self.__query_processor(q)
-                res = self.__search(purified_q)
-                self.__display_results(res)
+                res = self.__cached_search(q, self.search_score_mode)
+                t = clock(self.metrics)
+                self.__display_results(res, q)
+                lap(self.metrics, 'search.display', t)
@@ -0,0 +1,276 @@
+import argparse, asyncio, json, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+import search_engine
+from metrics import Histogram
+from search_engine import SearchEngine
+
+# HTTP/JSON query service over a search engine (asyncio, no outside dependencies)
+#   GET  /search?q=...&k=10           -> {'query', 'k', 'results': [{'doc_id', 'score', 'title', 'url'}], 'took_ms'}
+#   POST /search {"query": "...", "k": 10}
+#   GET  /stats                       -> request counters, latency percentiles and batch sizes
+#   GET  /health
+# concurrent requests are collected into micro-batches ranked by engine.rank_batch(): repeated queries are ranked
+# once, and with numpy backend postings of a term shared by queries are added once per batch
+# with workers > 1 a batch is split between forked processes
+# requests already waiting are batched without delay, max_batch_delay (opt-in, 0 by default) waits for more of them
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error', 504: 'Gateway Timeout'}
+
+# Latencies of last requests (seconds) and their percentiles, kept in a metrics histogram
+class LatencyWindow:
+
+    def __init__(self, max_size:int=10000) -> None:
+        self.histogram = Histogram(max_size)
+
+    def add(self, latency:float):
+        self.histogram.observe(latency)
+
+    # p-th percentile (nearest rank) of window, 0 if it is empty
+    def percentile(self, p:float) -> float:
+        return self.histogram.percentile(p)
+
+    def stats(self) -> Dict[str, float]:
+        latencies = self.histogram.samples
+        return {
+            'count': len(latencies),
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': max(latencies, default=0.0) * 1000,
+        }
+
+
+class SearchService:
+
+    def __init__(self, engine:SearchEngine, workers:int=1, max_batch_size:int=32, max_batch_delay:float=0.0, timeout:float=2.0, max_k:int=100) -> None:
+        self.engine = engine                        # running search engine (index is loaded once)
+        self.workers = max(1, workers)              # ranking processes (forked, they share loaded index)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_delay = max_batch_delay      # seconds a batch waits for more requests (0: no waiting)
+        self.timeout = timeout                      # seconds per request, None disables it
+        self.max_k = max_k
+        self.queue = None                           # (query, k, future) waiting for a batch
+        self.pool = None
+        self.executor = ThreadPoolExecutor(1)       # runs batches and reads docs, so event loop is never blocked
+        self.batcher = None
+        self.server = None
+        self.latency = LatencyWindow()
+        self.batch_sizes = deque(maxlen=10000)      # sizes of last batches
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    # ranks a batch of (query, k) -> ranked (doc_id, score) lists
+    # batch is ranked with largest k of its requests, top k of a smaller k is a prefix of it
+    # with workers > 1 batch is split into one chunk per forked process
+    def __rank_batch(self, batch:List[Tuple[str, int]]) -> List[List[Tuple[str, float]]]:
+        queries = [query for query, _ in batch]
+        max_k = max(k for _, k in batch)
+        if self.pool is not None and len(batch) > 1:
+            chunk_size = -(-len(batch) // self.workers)
+            chunks = [(queries[i:i + chunk_size], max_k) for i in range(0, len(queries), chunk_size)]
+            results = [res for chunk in self.pool.map(search_engine._batch_rank, chunks) for res in chunk]
+        else:
+            results = self.engine.rank_batch(queries, max_k)
+        return [res[:k] for res, (_, k) in zip(results, batch)]
+
+    # results of a query with titles and urls of their docs (reads document store)
+    def __documents(self, res:List[Tuple[str, float]]) -> List[dict]:
+        results = []
+        for doc_id, score in res:
+            doc = self.engine.get_document(doc_id)
+            results.append({'doc_id': doc_id, 'score': score, 'title': doc['title'], 'url': doc['url']})
+        return results
+
+    # collects queued requests into batches: a batch is closed when it is full, or when queue is empty
+    # and max batch delay is over
+    async def __batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_batch_delay
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # requests which are already timed out are not ranked
+            batch = [item for item in batch if not item[2].done()]
+            if len(batch) == 0:
+                continue
+            self.batch_sizes.append(len(batch))
+            try:
+                results = await loop.run_in_executor(self.executor, self.__rank_batch, [(query, k) for query, k, _ in batch])
+                for (_, _, future), res in zip(batch, results):
+                    if not future.done():
+                        future.set_result(res)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    # ranks one query through batcher -> response of /search
+    async def search(self, query:str, k:int) -> dict:
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, k, future))
+        res = await asyncio.wait_for(future, self.timeout)
+        results = await asyncio.get_running_loop().run_in_executor(self.executor, self.__documents, res)
+        return {'query': query, 'k': k, 'results': results, 'took_ms': (time.perf_counter() - start) * 1000}
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'latency': self.latency.stats(),
+            'batches': len(self.batch_sizes),
+            'mean_batch_size': sum(self.batch_sizes) / len(self.batch_sizes) if len(self.batch_sizes) > 0 else 0.0,
+            'workers': self.workers,
+        }
+
+    # routes a request -> (status, json body)
+    async def __handle(self, method:str, target:str, body:bytes) -> Tuple[int, dict]:
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'docs': self.engine.max_doc}
+        if url.path == '/stats':
+            return 200, self.stats()
+        if url.path != '/search':
+            return 404, {'error': 'not found'}
+        if method == 'GET':
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            query = params.get('q', '')
+            k = params.get('k', self.engine.max_display_res)
+        elif method == 'POST':
+            try:
+                params = json.loads(body.decode('utf-8') or '{}')
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                return 400, {'error': 'invalid json: {}'.format(e)}
+            if not isinstance(params, dict):
+                return 400, {'error': 'body must be a json object'}
+            query = params.get('query', '')
+            k = params.get('k', self.engine.max_display_res)
+        else:
+            return 405, {'error': 'method not allowed'}
+        try:
+            k = int(k)
+        except (TypeError, ValueError):
+            return 400, {'error': 'k must be an integer'}
+        if not isinstance(query, str) or query.strip() == '':
+            return 400, {'error': 'empty query'}
+        self.requests += 1
+        start = time.perf_counter()
+        try:
+            res = await self.search(query, min(max(1, k), self.max_k))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return 504, {'error': 'timeout after {} seconds'.format(self.timeout)}
+        except Exception as e:
+            self.errors += 1
+            return 500, {'error': str(e)}
+        finally:
+            self.latency.add(time.perf_counter() - start)
+        return 200, res
+
+    # one http connection: requests are served until client closes it (keep-alive)
+    async def __serve_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                if int(headers.get('content-length', 0)) > 0:
+                    body = await reader.readexactly(int(headers['content-length']))
+                if len(parts) != 3:
+                    status, res = 400, {'error': 'bad request line'}
+                else:
+                    status, res = await self.__handle(parts[0].upper(), parts[1], body)
+                keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                payload = json.dumps(res, ensure_ascii=False).encode('utf-8')
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                    status, STATUS_TEXT[status], len(payload), 'keep-alive' if keep_alive else 'close').encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # starts worker pool, batcher and http server
+    async def start(self, host:str='127.0.0.1', port:int=8080):
+        if self.workers > 1 and 'fork' in get_all_start_methods():
+            search_engine._batch_engine = self.engine
+            self.pool = get_context('fork').Pool(self.workers)
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.__batch_loop())
+        self.server = await asyncio.start_server(self.__serve_connection, host, port)
+        print('Search service is up on http://{}:{}'.format(*self.server.sockets[0].getsockname()[:2]))
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.batcher is not None:
+            self.batcher.cancel()
+            self.batcher = None
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+            search_engine._batch_engine = None
+        self.executor.shutdown(wait=False)
+
+    async def serve_forever(self, host:str='127.0.0.1', port:int=8080):
+        await self.start(host, port)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP/JSON search service')
+    parser.add_argument('--index', default='./index.json')
+    parser.add_argument('--refined-db', default='./refined_db.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-batch-delay', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=2.0)
+    parser.add_argument('--score-mode', default='tf_idf')
+    parser.add_argument('--backend', default='python')
+    args = parser.parse_args()
+    engine = SearchEngine(args.index, args.refined_db)
+    engine.run()
+    engine.set_search_score_mode(args.score_mode)
+    engine.set_scoring_backend(args.backend)
+    service = SearchService(engine, args.workers, args.max_batch_size, args.max_batch_delay, args.timeout)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import json, math, os
+from array import array
+from typing import Dict, List, Tuple
+from lru_cache import LRUCache
+from index_files import segment_addr, tombstones_addr
+
+# Incremental index updates
+# New docs are written as small delta segments next to the main (base) index, deleted docs are marked
+# in a tombstone bitmap of the segment holding them. The manifest lists the segments:
+#   {'segments': [{'name': 'delta1', 'docs': [doc_id, ...]}, ...], 'next_segment': int, 'max_doc': live docs,
+#    'stop_words': [...], 'index_format': 'json'|'binary', 'champions_size': int, 'champions_order': str,
+#    'tier1_fraction': float, 'generation': int, 'base': generation name of base files or None,
+#    'tombstones': {segment name: tombstones file name}, 'retired': [files replaced by last update]}
+# An update never rewrites a file listed in the manifest: merged base files and tombstones are written under
+# new generation names and saving the manifest switches to them. Files it replaced are removed by the next
+# update, so a reader which loaded the previous manifest can still open them.
+
+
+# Loads manifest of segments, None if index has no manifest
+def load_manifest(addr:str):
+    try:
+        with open(addr, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+# Saves manifest (atomic, readers never see a half written manifest)
+def save_manifest(addr:str, manifest:dict):
+    with open(addr + '.tmp', 'w', encoding='UTF-8') as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    os.replace(addr + '.tmp', addr)
+
+# Loads a tombstone bitmap (empty if segment has no deleted docs)
+def load_tombstones(addr:str) -> bytearray:
+    try:
+        with open(addr, 'rb') as file:
+            return bytearray(file.read())
+    except FileNotFoundError:
+        return bytearray()
+
+def save_tombstones(addr:str, tombstones:bytearray):
+    with open(addr + '.tmp', 'wb') as file:
+        file.write(tombstones)
+    os.replace(addr + '.tmp', addr)
+
+# Address of a base file (index or refined db) in manifest: './index.json' -> './index.gen2.json'
+# base files of a fresh index (no manifest or no generation) are the given address
+def base_addr(addr:str, manifest:dict) -> str:
+    if manifest is None or manifest.get('base') is None:
+        return addr
+    return segment_addr(addr, manifest['base'])
+
+# Address of tombstone bitmap of a segment ('base' is the main index), None if the segment has no deleted docs
+# manifests of older indexes do not list tombstones, their bitmaps are at tombstones_addr(index, segment name)
+def segment_tombstones_addr(index_addr:str, manifest:dict, name:str):
+    if 'tombstones' not in manifest:
+        return tombstones_addr(index_addr, name)
+    if name not in manifest['tombstones']:
+        return None
+    return tombstones_addr(index_addr, manifest['tombstones'][name])
+
+# Loads tombstones of a segment in manifest (empty if segment has no deleted docs)
+def load_segment_tombstones(index_addr:str, manifest:dict, name:str) -> bytearray:
+    addr = segment_tombstones_addr(index_addr, manifest, name)
+    return load_tombstones(addr) if addr is not None else bytearray()
+
+def is_deleted(tombstones:bytearray, doc_id:int) -> bool:
+    return (doc_id >> 3) < len(tombstones) and tombstones[doc_id >> 3] & (1 << (doc_id & 7)) != 0
+
+def mark_deleted(tombstones:bytearray, doc_id:int):
+    if (doc_id >> 3) >= len(tombstones):
+        tombstones.extend(bytes((doc_id >> 3) + 1 - len(tombstones)))
+    tombstones[doc_id >> 3] |= 1 << (doc_id & 7)
+
+# Returns (sorted doc ids, tfs, max tf, max normalized weight) of a term in an index (json dict, compact or binary)
+def read_postings(index, term:str) -> Tuple[array, array, int, float]:
+    if not isinstance(index, dict):
+        doc_ids, tfs, max_tf, _, max_nw = index.postings(term)
+        return doc_ids, tfs, max_tf, max_nw
+    entry = index[term]
+    postings_list = entry['postings_list']
+    doc_ids = array('I', sorted(int(x) for x in postings_list))
+    tfs = array('I', [postings_list[str(x)]['tf'] for x in doc_ids])
+    return doc_ids, tfs, entry['max_tf'], entry['max_nw']
+
+# Returns {doc_id: positions} of given sorted doc ids of a term (docs not in its postings are skipped)
+def read_positions(index, term:str, doc_ids:List[int]) -> Dict[int, List[int]]:
+    if not isinstance(index, dict):
+        return index.positions(term, doc_ids)
+    postings_list = index[term]['postings_list'] if term in index else dict()
+    return {doc_id: postings_list[str(doc_id)]['positions'] for doc_id in doc_ids if str(doc_id) in postings_list}
+
+
+# Read-only view over base index and its delta segments, without deleted docs
+# It acts like the index (json dict, CompactIndex or BinaryIndex) of search engine: df and idf are computed from live docs,
+# max tf and max normalized weight are the max of segments (still upper bounds)
+class SegmentedIndex:
+
+    def __init__(self, segments:List[Tuple[object, bytearray]], max_doc:int, cache_size:int=4096) -> None:
+        self.segments = segments        # [(index, tombstones)], base first
+        self.max_doc = max_doc          # number of live docs
+        self.merged = LRUCache(cache_size)  # term -> merged postings of recently used terms
+
+    # Releases binary segments
+    def close(self):
+        for index, _ in self.segments:
+            if not isinstance(index, dict):
+                index.close()
+        self.merged.clear()
+
+    # Returns (sorted doc ids, tfs, max tf, idf, max normalized weight) of live postings of a term
+    def postings(self, term:str) -> Tuple[array, array, int, float, float]:
+        postings = self.merged.get(term)
+        if postings is not None:
+            return postings
+        doc_ids = array('I')
+        tfs = array('I')
+        max_tf = 0
+        max_nw = 0.0
+        parts = []
+        for index, tombstones in self.segments:
+            if term not in index:
+                continue
+            seg_doc_ids, seg_tfs, seg_max_tf, seg_max_nw = read_postings(index, term)
+            max_tf = max(max_tf, seg_max_tf)
+            max_nw = max(max_nw, seg_max_nw)
+            parts.extend((doc_id, tf) for doc_id, tf in zip(seg_doc_ids, seg_tfs) if not is_deleted(tombstones, doc_id))
+        # a doc is live in one segment only, sorting the parts is enough
+        parts.sort()
+        for doc_id, tf in parts:
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+        idf = math.log10(self.max_doc/len(doc_ids)) if len(doc_ids) > 0 else 0.0
+        postings = (doc_ids, tfs, max_tf, idf, max_nw)
+        self.merged.put(term, postings)
+        return postings
+
+    # Returns {doc_id: positions} of given sorted live doc ids of a term
+    def positions(self, term:str, doc_ids:List[int]) -> Dict[int, List[int]]:
+        res = dict()
+        for index, tombstones in self.segments:
+            if term in index:
+                live_doc_ids = [doc_id for doc_id in doc_ids if not is_deleted(tombstones, doc_id)]
+                res.update(read_positions(index, term, live_doc_ids))
+        return res
+
+    # Returns live entry of a term like index.json: {'freq', 'df', 'idf', 'max_tf', 'max_nw', 'postings_list'}
+    def get(self, term:str, default=None):
+        if term not in self:
+            return default
+        postings_list = dict()
+        for index, tombstones in self.segments:
+            entry = index.get(term)
+            if entry is None:
+                continue
+            for doc_id in entry['postings_list']:
+                if not is_deleted(tombstones, int(doc_id)):
+                    postings_list[doc_id] = entry['postings_list'][doc_id]
+        postings_list = {doc_id: postings_list[doc_id] for doc_id in sorted(postings_list, key=int)}
+        _, tfs, max_tf, idf, max_nw = self.postings(term)
+        return {'freq': sum(tfs), 'df': len(tfs), 'idf': idf, 'max_tf': max_tf, 'max_nw': max_nw, 'postings_list': postings_list}
+
+    def __getitem__(self, term:str) -> dict:
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    # a term exists if it has at least one live doc
+    def __contains__(self, term:str) -> bool:
+        return len(self.postings(term)[0]) > 0
+
+    def __iter__(self):
+        terms = set()
+        for index, _ in self.segments:
+            terms.update(iter(index))
+        for term in sorted(terms):
+            if term in self:
+                yield term
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def keys(self) -> List[str]:
+        return list(iter(self))
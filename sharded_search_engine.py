@@ -0,0 +1,198 @@
+import os, sys
+from multiprocessing import get_all_start_methods, get_context
+from typing import Dict, List, Tuple
+from index_files import segment_addr, shards_addr
+from search_engine import SearchEngine
+from segments import load_manifest
+
+# Loop of a shard worker process: owns search engine of one shard and answers (method, args) requests
+# docs of results are read from document store of their shard, so coordinator does not load refined dbs of shards
+def _shard_worker(conn, index_addr:str, refined_db_addr:str, enable_normalizer:bool, debug_mode:bool, global_idf:Dict[str, float], stop_words:List[str]):
+    if not debug_mode:
+        sys.stdout = open(os.devnull, 'w')
+    engine = SearchEngine(index_addr, refined_db_addr, enable_normalizer, debug_mode)
+    engine.run()
+    engine.set_global_idf(global_idf)
+    engine.set_stop_words(stop_words)
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            res = getattr(engine, method)(*args)
+            conn.send((True, res))
+        except Exception as e:
+            conn.send((False, e))
+    conn.close()
+
+# This is the search engine of a sharded index (Indexer with shards > 1)
+# each shard is searched by a search engine in its own worker process, a query is sent to all shards
+# in parallel and their top k lists are merged; shards use global idf, so results equal one unsharded index
+class ShardedSearchEngine:
+
+    def __init__(self, index_addr:str, refined_db_addr:str, enable_normalizer:bool=True, debug_mode:bool=False) -> None:
+        self.index_addr = index_addr
+        self.refined_db_addr = refined_db_addr
+        self.enable_normalizer = enable_normalizer
+        self.DEBUG = debug_mode
+        self.index_is_loaded = False
+        self.max_doc = 0
+        self.max_display_res = 5
+        self.workers = []           # [(process, connection)] of shards
+
+    # sends a request to all shards and gathers their answers in shard order
+    def __scatter_gather(self, method:str, args:tuple=()) -> list:
+        for _, conn in self.workers:
+            conn.send((method, args))
+        answers = []
+        error = None
+        for _, conn in self.workers:
+            ok, res = conn.recv()
+            if not ok:
+                error = res
+            answers.append(res)
+        if error is not None:
+            raise error
+        return answers
+
+    # Displays result of search, docs and snippets come from the shards holding them
+    def __display_results(self, res:List[Tuple[str, float]], query:str):
+        print("Search Results:")
+        if len(res) == 0:
+            print("no result found!")
+            return
+        doc_ids = [doc_id for doc_id, _ in res[:self.max_display_res]]
+        shard_doc_ids = [[doc_id for doc_id in doc_ids if int(doc_id) % len(self.workers) == i] for i in range(len(self.workers))]
+        docs = dict()
+        for i in range(len(self.workers)):
+            if len(shard_doc_ids[i]) > 0:
+                docs.update(zip(shard_doc_ids[i], self.__request(i, 'documents', (shard_doc_ids[i], query))))
+        count = 0
+        for doc_id in doc_ids:
+            count += 1
+            print('{} - Title: {}'.format(count, docs[doc_id]['title']))
+            print(docs[doc_id]['snippet'].replace('\n', ' '))
+            print(docs[doc_id]['url'].replace('\n', ' '))
+
+    # sends a request to one shard
+    def __request(self, shard:int, method:str, args:tuple=()):
+        conn = self.workers[shard][1]
+        conn.send((method, args))
+        ok, res = conn.recv()
+        if not ok:
+            raise res
+        return res
+
+    # searches all shards and merges their top k: higher score first, lower doc id first on equal scores
+    def __search(self, query:str, k:int) -> List[Tuple[str, float]]:
+        res = []
+        for shard_res in self.__scatter_gather('rank', (query, k)):
+            res.extend(shard_res)
+        res.sort(key=lambda x: (-x[1], int(x[0])))
+        return res[:k]
+
+    # starts one worker process per shard
+    def run(self):
+        print("Running sharded search engine...")
+        self.close()
+        manifest = load_manifest(shards_addr(self.index_addr))
+        if manifest is None:
+            print("file not found in '{}'".format(shards_addr(self.index_addr)))
+            return
+        context = get_context('fork' if 'fork' in get_all_start_methods() else 'spawn')
+        for name in manifest['shards']:
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_worker, daemon=True, args=(child_conn, segment_addr(self.index_addr, name),
+                                      segment_addr(self.refined_db_addr, name), self.enable_normalizer, self.DEBUG, manifest['idf'],
+                                      manifest.get('stop_words')))
+            process.start()
+            child_conn.close()
+            self.workers.append((process, conn))
+        self.max_doc = manifest['max_doc']
+        self.index_is_loaded = True
+        if self.DEBUG:
+            print("Max Doc:{}, shards: {}".format(self.max_doc, len(self.workers)))
+        print("Engine is up.")
+
+    # stops worker processes of shards
+    def close(self):
+        for process, conn in self.workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join()
+            conn.close()
+        self.workers = []
+        self.index_is_loaded = False
+
+    # set score function of all shards
+    def set_search_score_mode(self, mode='tf_idf'):
+        self.__scatter_gather('set_search_score_mode', (mode,))
+        print('search mode set to \'{}\'. if not exist default is tf_idf'.format(mode))
+
+    # set query mode of all shards: 'or' (default), 'and' or 'phrase'
+    def set_query_mode(self, mode='or'):
+        self.__scatter_gather('set_query_mode', (mode,))
+        print('query mode set to \'{}\'.'.format(mode if mode in ('and', 'phrase') else 'or'))
+
+    # set proximity boost of all shards (positions are in shards, so boosted scores are the same)
+    def set_proximity_boost(self, boost:float=0.0):
+        self.__scatter_gather('set_proximity_boost', (boost,))
+
+    # set scoring backend of all shards: 'python' (default) or 'numpy'
+    def set_scoring_backend(self, backend='python'):
+        self.__scatter_gather('set_scoring_backend', (backend,))
+
+    # enables/disables WAND dynamic pruning of all shards
+    def set_dynamic_pruning(self, enable:bool=True):
+        self.__scatter_gather('set_dynamic_pruning', (enable,))
+
+    # set number of terms kept in each postings cache of all shards
+    def set_postings_cache_size(self, size:int=4096):
+        self.__scatter_gather('set_postings_cache_size', (size,))
+
+    # enables/disables tiered search of all shards (shards of a tiered index have their own tiers)
+    def set_tiered_search(self, enable:bool=True):
+        self.__scatter_gather('set_tiered_search', (enable,))
+
+    # champions lists of shards: saved lists of shards together are the champions lists of whole index,
+    # with x_most_related each shard keeps its own x docs per term
+    def enable_champions_list(self, x_most_related = None):
+        self.__scatter_gather('enable_champions_list', (x_most_related,))
+
+    def disable_champions_list(self):
+        self.__scatter_gather('disable_champions_list')
+
+    # set max display res
+    def set_max_display_res(self, max_display_res:int):
+        self.max_display_res = max(1, max_display_res)
+
+    # returns ranked (doc_id, score) of a query
+    def rank(self, query:str, k:int=None) -> List[Tuple[str, float]]:
+        if k is None:
+            k = self.max_display_res
+        if k <= 0:
+            return []
+        return self.__search(query, k)
+
+    # runs many queries, each query is searched by all shards in parallel
+    def search_batch(self, queries:List[str], k:int=None) -> List[List[Tuple[str, float]]]:
+        if not self.index_is_loaded:
+            print('Please run() engine first!')
+            return []
+        return [self.rank(q, k) for q in queries]
+
+    # use this function to search
+    def search(self, query=''):
+        if not self.index_is_loaded:
+            print('Please run() engine first!')
+            return
+        if query != '':
+            self.__display_results(self.__search(query, self.max_display_res), query)
+        else:
+            q = ''
+            while q.lower() != 'exit':
+                q = input('Please Type Your Query: ')
+                self.__display_results(self.__search(q, self.max_display_res), q)
@@ -0,0 +1,42 @@
+import json, os, sys
+import pytest
+
+# modules of the project are in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import generate_corpus, generate_queries
+from indexer import Indexer
+
+# Small synthetic corpus and indexes built once per test session (text processing tools are slow to load)
+
+
+@pytest.fixture(scope='session')
+def corpus():
+    return generate_corpus(400, vocab_size=3000, doc_len=60, seed=7)
+
+@pytest.fixture(scope='session')
+def queries(corpus):
+    return generate_queries(corpus, 40, seed=11)
+
+@pytest.fixture(scope='session')
+def corpus_addr(corpus, tmp_path_factory):
+    addr = str(tmp_path_factory.mktemp('corpus') / 'corpus.json')
+    with open(addr, 'w', encoding='UTF-8') as file:
+        json.dump(corpus, file, ensure_ascii=False)
+    return addr
+
+# index with champions lists and tiers -> (index address, refined db address)
+@pytest.fixture(scope='session')
+def index_addrs(corpus_addr, tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp('index')
+    index_addr, refined_db_addr = str(work_dir / 'index.json'), str(work_dir / 'refined_db.json')
+    Indexer(corpus_addr, index_addr, refined_db_addr, 10, champions_size=10, tier1_fraction=0.2).run()
+    return index_addr, refined_db_addr
+
+# the same index in 3 shards -> (index address, refined db address)
+@pytest.fixture(scope='session')
+def sharded_index_addrs(corpus_addr, tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp('shards')
+    index_addr, refined_db_addr = str(work_dir / 'index.json'), str(work_dir / 'refined_db.json')
+    Indexer(corpus_addr, index_addr, refined_db_addr, 10, champions_size=10, tier1_fraction=0.2, shards=3).run()
+    return index_addr, refined_db_addr
@@ -0,0 +1,77 @@
+import io, random
+import pytest
+from binary_index import BinaryIndex, decode_varints, encode_varint, is_binary_index, write_binary_index
+from postings import CompactIndex
+
+# Binary and json index files must give back the postings, positions and statistics they were written from
+
+
+@pytest.fixture(scope='module')
+def index():
+    rng = random.Random(5)
+    vocab = ['term{}'.format(i) for i in range(200)] + ['کتاب', 'خانه', 'é']
+    index = CompactIndex()
+    for doc_id in range(0, 3000, 3):
+        index.add_document(doc_id, [rng.choice(vocab[:rng.randint(1, len(vocab))]) for _ in range(rng.randint(1, 40))])
+    index.sort()
+    for term, entry in index.terms.items():
+        entry.idf = rng.random() * 3
+        entry.max_nw = rng.random()
+    return index
+
+@pytest.fixture(scope='module')
+def binary_index(index, tmp_path_factory):
+    addr = str(tmp_path_factory.mktemp('binary') / 'index.bin')
+    write_binary_index(index, addr)
+    binary_index = BinaryIndex(addr)
+    yield binary_index
+    binary_index.close()
+
+
+@pytest.mark.parametrize('n', [0, 1, 127, 128, 300, 16383, 16384, 2 ** 32 - 1, 2 ** 40])
+def test_varint_round_trip(n):
+    buf = bytearray()
+    encode_varint(n, buf)
+    encode_varint(7, buf)
+    assert decode_varints(bytes(buf)) == [n, 7]
+
+def test_terms(index, binary_index):
+    assert is_binary_index(binary_index.addr)
+    assert len(binary_index) == len(index)
+    assert sorted(binary_index) == sorted(index)
+    assert 'missing' not in binary_index
+    assert binary_index.get('missing') is None
+
+def test_postings(index, binary_index):
+    for term in index:
+        doc_ids, tfs, max_tf, idf, max_nw = binary_index.postings(term)
+        expected = index.postings(term)
+        assert (list(doc_ids), list(tfs), max_tf, idf, max_nw) == (list(expected[0]), list(expected[1])) + expected[2:]
+
+def test_entries(index, binary_index):
+    for term in index:
+        assert binary_index.get(term) == index.get(term)
+
+def test_positions_of_some_docs(index, binary_index):
+    rng = random.Random(9)
+    for term in index:
+        doc_ids = index.postings(term)[0]
+        wanted = sorted(rng.sample(list(doc_ids), min(len(doc_ids), 3)) + [1, 2999])
+        assert binary_index.positions(term, wanted) == index.positions(term, wanted)
+
+def test_json_round_trip(index):
+    file = io.StringIO()
+    index.write_json(file)
+    file.seek(0)
+    loaded = CompactIndex.load_json(file)
+    assert list(loaded) == list(index)
+    for term in index:
+        assert loaded.get(term) == index.get(term)
+
+def test_not_a_binary_index(tmp_path):
+    addr = str(tmp_path / 'index.json')
+    with open(addr, 'w') as file:
+        file.write('{}')
+    assert not is_binary_index(addr)
+    with pytest.raises(ValueError):
+        BinaryIndex(addr)
@@ -0,0 +1,34 @@
+import io, json
+import pytest
+from json_stream import iter_json_object
+
+# iter_json_object must give the members of json.load, whatever the buffer size
+
+
+DOCUMENTS = [
+    {},
+    {'1': {'title': 'عنوان', 'content': 'متن خبر', 'url': 'https://example.com/1'}},
+    {str(i): {'title': 't{}'.format(i), 'content': 'word ' * i, 'tags': [i, -i, i / 3, None, True]} for i in range(50)},
+    {'a': 1, 'b': -2.5e-3, 'c': 12345678901234567890, 'd': 'x', 'e': [], 'f': {}, 'g': False, 'h': None},
+    {'escaped': 'quote " backslash \\ newline \n tab \t unicode é ف', 'nested': {'a': [{'b': [{'c': 'deep'}]}]}},
+    {'large': 'x' * 100000, 'after': 1},
+]
+
+
+@pytest.mark.parametrize('doc', DOCUMENTS)
+@pytest.mark.parametrize('buffer_size', [1, 2, 7, 64, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_round_trip(doc, buffer_size, indent):
+    text = json.dumps(doc, indent=indent, ensure_ascii=False)
+    assert list(iter_json_object(io.StringIO(text), buffer_size)) == list(doc.items())
+
+# a number split between two reads is read whole
+@pytest.mark.parametrize('buffer_size', range(1, 12))
+def test_number_at_chunk_boundary(buffer_size):
+    text = '{"n": 1234567.25e2, "m": 98765}'
+    assert dict(iter_json_object(io.StringIO(text), buffer_size)) == json.loads(text)
+
+@pytest.mark.parametrize('text', ['', '[1, 2]', '{"a": 1', '{"a" 1}', '{1: 2}', '{"a": [1, 2}'])
+def test_invalid_json(text):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_object(io.StringIO(text), 4))
@@ -0,0 +1,86 @@
+import pytest
+import search_engine
+from search_engine import SearchEngine
+from sharded_search_engine import ShardedSearchEngine
+
+# Top k of every search path (WAND, tiers, numpy backend, shards) must be the top k of scoring every candidate
+
+PATHS = ['wand', 'tiers', 'numpy']
+MODES = [(score_mode, query_mode) for score_mode in ('tf_idf', 'cosine') for query_mode in ('or', 'and')]
+
+
+@pytest.fixture(scope='module')
+def engine(index_addrs):
+    engine = SearchEngine(*index_addrs)
+    engine.run()
+    return engine
+
+@pytest.fixture(scope='module')
+def sharded_engine(sharded_index_addrs):
+    engine = ShardedSearchEngine(*sharded_index_addrs)
+    engine.run()
+    yield engine
+    engine.close()
+
+# sets search path of engine, result cache is disabled so every path really ranks the queries
+def use_path(engine:SearchEngine, path:str, score_mode:str='tf_idf', query_mode:str='or'):
+    if path == 'numpy' and search_engine.np is None:
+        pytest.skip('numpy is not installed')
+    engine.disable_cache()
+    engine.disable_champions_list()
+    engine.set_search_score_mode(score_mode)
+    engine.set_query_mode(query_mode)
+    engine.set_scoring_backend('numpy' if path == 'numpy' else 'python')
+    engine.set_dynamic_pruning(path in ('wand', 'tiers'))
+    engine.set_tiered_search(path == 'tiers')
+
+def assert_same_results(expected, got):
+    assert len(got) == len(expected)
+    for a, b in zip(expected, got):
+        assert [doc_id for doc_id, _ in b] == [doc_id for doc_id, _ in a]
+        assert [score for _, score in b] == pytest.approx([score for _, score in a], rel=1e-9, abs=1e-12)
+
+def rank_all(engine, queries, k):
+    return [engine.rank(query, k) for query in queries]
+
+
+def test_index_has_tiers(engine):
+    assert engine.tier1 is not None
+
+@pytest.mark.parametrize('path', PATHS)
+@pytest.mark.parametrize('score_mode,query_mode', MODES)
+@pytest.mark.parametrize('k', [1, 10])
+def test_path_equals_exhaustive(engine, queries, path, score_mode, query_mode, k):
+    use_path(engine, 'exhaustive', score_mode, query_mode)
+    expected = rank_all(engine, queries, k)
+    assert any(len(res) > 0 for res in expected)
+    use_path(engine, path, score_mode, query_mode)
+    assert_same_results(expected, rank_all(engine, queries, k))
+
+@pytest.mark.parametrize('score_mode,query_mode', MODES)
+def test_shards_equal_exhaustive(engine, sharded_engine, queries, score_mode, query_mode):
+    use_path(engine, 'exhaustive', score_mode, query_mode)
+    sharded_engine.set_search_score_mode(score_mode)
+    sharded_engine.set_query_mode(query_mode)
+    assert_same_results(rank_all(engine, queries, 10), rank_all(sharded_engine, queries, 10))
+
+@pytest.mark.parametrize('path', ['exhaustive'] + PATHS)
+def test_rank_batch_equals_rank(engine, queries, path):
+    use_path(engine, path)
+    batch = queries + queries[:5]
+    assert engine.rank_batch(batch, 10) == rank_all(engine, batch, 10)
+
+@pytest.mark.parametrize('path', ['exhaustive'] + PATHS)
+def test_no_results_for_k_zero(engine, queries, path):
+    use_path(engine, path)
+    assert engine.rank(queries[0], 0) == []
+    assert engine.rank(queries[0], -1) == []
+    assert engine.rank_batch(queries[:3], 0) == [[], [], []]
+
+def test_repeated_query_is_served_from_result_cache(engine, queries):
+    use_path(engine, 'wand')
+    engine.enable_cache()
+    first = engine.rank(queries[0], 10)
+    hits = engine.cache_stats()['result']['hits']
+    assert engine.rank(queries[0], 10) == first
+    assert engine.cache_stats()['result']['hits'] == hits + 1
@@ -0,0 +1,121 @@
+import time
+from typing import Dict, List, Tuple
+from hazm import Normalizer, Lemmatizer, word_tokenize
+from lru_cache import LRUCache
+
+# useless notations are replaced with space
+USELESS_NOTATIONS = ['_' ,'-', '+', '*', '%', '$', '/', '.', '!', '(', ')', '^', '=', '<', '>', '?', '&', '@', '\\', ';', '\'', '\"', '{', '}', '[', ']', ':', '«', '»', ',']
+
+# This is the text processing pipeline shared by indexer and search engine
+# normalize -> remove useless notations -> tokenize -> lemmatize (memoized)
+# it also keeps time spent in each stage and hit rate of lemma cache
+class TextProcessor:
+
+    def __init__(self, enable_normalizer:bool=True, lemma_cache_size:int=100000) -> None:
+        self.enable_normalizer = enable_normalizer
+        self.normalizer = Normalizer().normalize
+        self.stemmer = Lemmatizer().lemmatize
+        self.tokenizer = word_tokenize
+        self.noise_table = str.maketrans({c: ' ' for c in USELESS_NOTATIONS})
+        self.lemma_cache = LRUCache(lemma_cache_size)   # surface form -> lemma
+        self.__reset_counters()
+
+    def __reset_counters(self):
+        self.documents = 0
+        self.tokens = 0
+        self.normalize_time = 0.0
+        self.tokenize_time = 0.0
+        self.stem_time = 0.0
+        self.lemma_cache.hits = 0
+        self.lemma_cache.misses = 0
+
+    # normalizes text and replaces useless notations with space (raw text if normalizer is disabled)
+    def normalize(self, text:str) -> str:
+        if not self.enable_normalizer:
+            return text
+        return self.normalizer(text).translate(self.noise_table)
+
+    def tokenize(self, text:str) -> List[str]:
+        return self.tokenizer(text)
+
+    # lemma of a token ('' if it has no lemma)
+    def stem(self, token:str) -> str:
+        stem = self.lemma_cache.get(token)
+        if stem is None:
+            stem = self.stemmer(token)
+            self.lemma_cache.put(token, stem)
+        return stem
+
+    # runs the whole pipeline on text and returns its terms
+    def process(self, text:str) -> List[str]:
+        start = time.perf_counter()
+        text = self.normalize(text)
+        normalized = time.perf_counter()
+        tokens = self.tokenize(text)
+        tokenized = time.perf_counter()
+        terms = []
+        for token in tokens:
+            stem = self.stem(token)
+            if stem != '':
+                terms.append(stem)
+        stemmed = time.perf_counter()
+        self.documents += 1
+        self.tokens += len(tokens)
+        self.normalize_time += normalized - start
+        self.tokenize_time += tokenized - normalized
+        self.stem_time += stemmed - tokenized
+        return terms
+
+    # Returns text for display (normalized, notations are kept) and span of each term of process(text) in it
+    # term at position p (positions start from 1) comes from text[spans[p - 1][0]:spans[p - 1][1]]
+    # document and time counters are not changed (it is used for snippets, not for indexing)
+    def term_spans(self, text:str) -> Tuple[str, List[Tuple[int, int]]]:
+        # useless notations are replaced one char by one space, so spans of tokens are the same in display text
+        if self.enable_normalizer:
+            text = self.normalizer(text)
+            tokens = self.tokenize(text.translate(self.noise_table))
+        else:
+            tokens = self.tokenize(text)
+        spans = []
+        cursor = 0
+        for token in tokens:
+            # tokenizer joins verb parts with '_': span goes from first part to last part
+            parts = token.replace('_', ' ').split() or [token]
+            start = text.find(parts[0], cursor)
+            end = text.find(parts[-1], start) + len(parts[-1]) if start >= 0 else -1
+            if start < 0 or end < len(parts[-1]):
+                start = end = cursor
+            if self.stem(token) != '':
+                spans.append((start, end))
+            cursor = end
+        return text, spans
+
+    # counters of processed texts, seconds spent in each stage and lemma cache hits
+    def stats(self) -> Dict[str, float]:
+        lookups = self.lemma_cache.hits + self.lemma_cache.misses
+        return {
+            'documents': self.documents,
+            'tokens': self.tokens,
+            'normalize_time': self.normalize_time,
+            'tokenize_time': self.tokenize_time,
+            'stem_time': self.stem_time,
+            'lemma_hits': self.lemma_cache.hits,
+            'lemma_misses': self.lemma_cache.misses,
+            'lemma_hit_rate': self.lemma_cache.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    # returns stats and resets counters (used to collect stats of worker processes)
+    def take_stats(self) -> Dict[str, float]:
+        stats = self.stats()
+        self.__reset_counters()
+        return stats
+
+    # adds counters of another processor (e.g. a worker process)
+    def add_stats(self, stats:Dict[str, float]):
+        self.documents += stats['documents']
+        self.tokens += stats['tokens']
+        self.normalize_time += stats['normalize_time']
+        self.tokenize_time += stats['tokenize_time']
+        self.stem_time += stats['stem_time']
+        self.lemma_cache.hits += stats['lemma_hits']
+        self.lemma_cache.misses += stats['lemma_misses']